@@ -122,12 +122,161 @@ WEBSITE_STRATEGIES = {
 # Base URLs for the different websites
 # RULE: THE URL HERE ENDS WITH A SLASH, THE REMAINDER PART OF THE URL IN THE CODE DOES NOT START WITH A SLASH
 BASE_URLS = {"m3-api-base": "https://api.m3.ifkw.lmu.de/",
+            "m3-login-base": "https://login.m3.ifkw.lmu.de/auth/",
             "spiegel": "https://www.spiegel.de/", 
             "zeit": "https://www.zeit.de/", 
             "sueddeutsche": "https://www.sueddeutsche.de/",
             "bayerischer_rundfunk": "https://www.br.de/nachrichten/",
             "t_online": "https://www.t-online.de/"}
 
+# Pagination parameters of the m3 API, used by the streaming iterators in DataDownloader. The *_field
+# entries name the page metadata of a response; without it a page shorter than page_size ends the listing
+M3_API_PAGINATION = {"page_param": "page",
+                     "size_param": "size",
+                     "first_page": 1,
+                     "page_size": 100,
+                     "pages_field": "pages",
+                     "total_field": "total",
+                     "size_field": "size"}
+
+# Client-side rate limit for the m3 API, shared by all clients of a process. Set lock_path to a file
+# (e.g. "/tmp/m3_api_rate_limit.json") to share the budget between processes on the same machine
+M3_API_RATE_LIMIT = {"requests_per_second": 20,
+                     "burst": 40,
+                     "lock_path": None,
+                     "max_retries": 5}
+
+# Time-to-live in seconds for cached reference data (media, entity types, topics, channels, devices, surveys)
+REFERENCE_DATA_CACHE_TTL = 24 * 60 * 60
+
+# File in which the reference data cache is persisted across runs, set to None to keep it in memory only
+REFERENCE_DATA_CACHE_PATH = "cache/reference_data.json"
+
+# Write-ahead log for processed articles that have not been acknowledged by the m3 API yet
+UPLOAD_SPOOL_PATH = "spool/upload_spool.jsonl"
+
+# SQLite file with the content hashes of uploaded articles, used to detect changes of re-scraped articles
+CONTENT_HASH_STORE_PATH = "cache/content_hashes.sqlite"
+
+# Micro-batching of the Kafka consumers: a batch is handed on as soon as max_records messages
+# arrived or max_wait_ms passed, whichever comes first
+# In manual commit mode, processed offsets are committed every commit_every_batches batches or
+# every commit_interval_ms, whichever comes first
+KAFKA_CONSUMER_SETTINGS = {"max_records": 32,
+                           "max_wait_ms": 500,
+                           "commit_every_batches": 10,
+                           "commit_interval_ms": 5000}
+
+# Batching and compression of the Kafka producer: messages are buffered for up to linger_ms or
+# until batch_size bytes per partition are collected, then sent compressed in one request
+KAFKA_PRODUCER_SETTINGS = {"linger_ms": 20,
+                           "batch_size": 256 * 1024,
+                           "compression_type": "zstd",  # or "lz4", both supported by kafka-python
+                           "acks": "all"}
+
+# Bounded hand-off between the consuming and the processing thread of process_data.py: when
+# max_batches micro-batches wait for the models, the Kafka partitions are paused until one is taken;
+# the buffer depth and wait times are logged every report_interval seconds
+HAND_OFF_SETTINGS = {"max_batches": 2,
+                     "report_interval": 60}
+
+# Claim checks: with enabled=True, scrape.py writes main_text and lead_text to a content-addressed
+# blob store and enqueues only references; the processing stages fetch the texts they need. The store
+# may be a shared directory; cache_path then keeps a local read-through cache of up to cache_max_bytes
+CLAIM_CHECK_SETTINGS = {"enabled": False,
+                        "store_path": "blobs",
+                        "cache_path": None,
+                        "cache_max_bytes": 1024 * 1024 * 1024}
+
+# Serialization of queue messages: "json", or "msgpack" for the versioned binary format with raw
+# float32 embeddings (kafka_queue/wire_format.py). Consumers read both, so switch the producers to
+# "msgpack" once all consumers run a version that understands it
+WIRE_FORMAT = "json"
+
+# Retries of articles that failed in an analysis stage or at upload: the n-th retry waits
+# base_delay_seconds * 2^(n-1), at most max_delay_seconds; after max_attempts failures an article is
+# moved to the dead letters (replay_dead_letters.py). Due retries are checked every poll_interval seconds
+RETRY_SETTINGS = {"path": "cache/retries.sqlite",
+                  "max_attempts": 5,
+                  "base_delay_seconds": 60,
+                  "max_delay_seconds": 6 * 60 * 60,
+                  "poll_interval": 30}
+
+# SQLite file with the articles (URL and content hash) the processing workers already forwarded, to skip
+# redelivered articles. Entries are kept for retention_days, which should exceed the topic retention;
+# memory_entries caps the in-memory set in front of the file
+PROCESSED_URL_STORE_SETTINGS = {"path": "cache/processed_articles.sqlite",
+                                "retention_days": 14,
+                                "memory_entries": 100000}
+
+# Staged analysis pipeline (process_stage.py): every stage reads the raw article topic in its own
+# consumer group and writes its results, keyed by URL, to the results topic; the merge stage joins
+# the results of all stages per URL and writes the final record to the output topic
+PIPELINE_TOPICS = {"input": "raw_articles",
+                   "results": "stage_results",
+                   "output": "processed_article_queue"}
+
+# Stage name -> (analysis class, method); "metadata" forwards the scraped fields without the texts
+PIPELINE_STAGES = {"ner": ("text_analysis.NEExtractor.NEExtractor", "extract_entities"),
+                   "topics": ("text_analysis.TopicExtractor.TopicExtractor", "extract_topics"),
+                   "vectors": ("text_analysis.Vectorizers.Vectorizer", "vectorize"),
+                   "summary": ("text_analysis.Summarizer.Summarizer", "summarize"),
+                   "metadata": (None, None)}
+
+# Analysis method -> the scraped text fields it reads; used to fetch only these texts from the blob
+# store (process_stage.py) and to decide which stages a changed text re-runs (ContentChangeDetector)
+STAGE_INPUTS = {"extract_entities": ("main_text",),
+                "extract_topics": ("main_text",),
+                "vectorize": ("lead_text", "main_text"),
+                "summarize": ("main_text",)}
+
+# SQLite file in which the merge stage keeps the partial results of articles until all stages reported
+PIPELINE_MERGE_STORE_PATH = "cache/pipeline_merge.sqlite"
+
+# Queue backend of the pipeline scripts: "kafka" needs a broker, "local" keeps an append-only
+# segmented log per topic on disk (kafka_queue/local_queue.py), for single-node runs and tests
+QUEUE_BACKEND = "kafka"
+LOCAL_QUEUE_SETTINGS = {"directory": "queue/log",
+                        "segment_bytes": 64 * 1024 * 1024,
+                        "poll_interval_ms": 50,
+                        "max_poll_records": 500}
+
+# In-process geo-focus inference (text_analysis/GeoFocus.py): the newsmap country dictionary in
+# quanteda's YAML format, which is committed with the code (validate_geo_focus.py --fetch-dictionary
+# downloads it from dictionary_url once), and the model settings of text_analysis/infer_geo_focus.R
+GEO_FOCUS_SETTINGS = {"dictionary_path": "text_analysis/newsmap_de.yml",
+                      "dictionary_url": "https://raw.githubusercontent.com/koheiw/newsmap/master/dict/german.yml",
+                      "min_termfreq": 10,
+                      "smooth": 1.0}
+
+# CPU inference profile: with quantize=True the transformer models of all analysis stages are
+# loaded as int8 dynamically quantized versions (text_analysis/Quantization.py), cached in cache_dir.
+# num_threads sets the torch thread count (None keeps the torch default)
+CPU_INFERENCE_SETTINGS = {"quantize": False,
+                          "cache_dir": "transformers_cache_dir/quantized",
+                          "num_threads": None}
+
+# Vectorizer engine per model key of TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION: "torch" runs the
+# sentence transformer in PyTorch, "onnx" exports it once to ONNX next to the transformers cache and
+# runs it with ONNX Runtime (text_analysis/OnnxSentenceEncoder.py). Keys missing here use "torch"
+VECTORIZATION_BACKENDS = {"bert": "torch",
+                          "roberta": "torch",
+                          "gbert": "torch",
+                          "xmlr": "torch",
+                          "bigbird": "torch",  # block-sparse attention, check the export before switching
+                          "longformer": "torch"}
+# Largest accepted absolute difference between ONNX and PyTorch embeddings when exporting
+ONNX_SETTINGS = {"tolerance": 1e-3,
+                 "opset_version": 14,
+                 "intra_op_num_threads": None}
+
+# Per-model cache of sentence embeddings in the Vectorizer (text_analysis/EmbeddingCache.py), keyed by
+# the hash of the normalized sentence. Each model gets max_bytes of memory-mapped float32 rows; beyond
+# that the least recently used sentences are replaced
+EMBEDDING_CACHE_SETTINGS = {"enabled": False,
+                            "path": "cache/embeddings",
+                            "max_bytes": 1024 * 1024 * 1024}
+
 # Regex patterns for article and subpage URLs
 PATTERNS = {
     'spiegel': {
@@ -0,0 +1,166 @@
+import contextlib
+import json
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from config import M3_API_RATE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Status codes with which the m3 API asks clients to back off
+THROTTLING_STATUS_CODES = (429, 503)
+
+class TokenBucketRateLimiter:
+    """A token bucket that limits the request rate of all m3 API clients.
+
+    The bucket holds up to `burst` tokens and refills at the current rate. When the API answers
+    with 429 or 503 the rate is halved and all clients pause for the Retry-After period; every
+    successful request raises the rate again by a small step, up to the configured maximum.
+
+    With a lock_path, the bucket state is kept in that file and guarded by an exclusive file lock,
+    so that several processes on the same machine share one budget.
+    """
+
+    def __init__(self, requests_per_second, burst, lock_path=None, min_requests_per_second=0.5, recovery_step=0.05, report_interval=30):
+        """Initialize the limiter with a maximum rate, a burst size and an optional file for cross-process coordination.
+        The accumulated throttling time is logged at most every report_interval seconds."""
+        self.max_rate = requests_per_second
+        self.burst = burst
+        self.lock_path = lock_path
+        self.min_rate = min_requests_per_second
+        self.recovery_step = recovery_step * requests_per_second
+        self.throttled_seconds = 0.0
+        self.throttled_requests = 0
+        self.report_interval = report_interval
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+        self._state = {"tokens": burst, "updated_at": time.time(), "rate": requests_per_second, "blocked_until": 0.0}
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        """Yield the bucket state under the thread lock and, if configured, the file lock."""
+        with self._lock:
+            if not self.lock_path:
+                yield self._state
+                return
+            import fcntl  # Only needed for cross-process coordination, which is POSIX-only
+
+            with open(self.lock_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = json.loads(content) if content else dict(self._state)
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state["updated_at"])
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+        state["updated_at"] = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        waited = 0.0
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                self._refill(state, now)
+                if state["blocked_until"] > now:
+                    wait = state["blocked_until"] - now
+                elif state["tokens"] >= 1:
+                    state["tokens"] -= 1
+                    break
+                else:
+                    wait = (1 - state["tokens"]) / state["rate"]
+            time.sleep(wait)
+            waited += wait
+
+        if waited > 0:
+            with self._lock:
+                self.throttled_seconds += waited
+                self.throttled_requests += 1
+                report = time.time() - self._last_report >= self.report_interval
+                if report:
+                    self._last_report = time.time()
+            logger.debug(f"Throttled for {waited:.2f} seconds before sending a request to the m3 API")
+            if report:
+                logger.info(f"Throttled {self.throttled_requests} requests to the m3 API for {self.throttled_seconds:.1f} seconds in total")
+
+    def penalize(self, retry_after=None):
+        """Halve the rate and pause all clients after a 429/503 response."""
+        with self._locked_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            state["rate"] = max(self.min_rate, state["rate"] / 2)
+            pause = retry_after if retry_after is not None else 1 / state["rate"]
+            state["blocked_until"] = max(state["blocked_until"], now + pause)
+            state["tokens"] = 0.0
+            rate = state["rate"]
+        logger.warning(f"m3 API asked to back off, pausing for {pause:.2f} seconds and lowering the rate to {rate:.2f} requests/s")
+
+    def reward(self):
+        """Raise the rate by one step towards the maximum after a successful request."""
+        with self._locked_state() as state:
+            if state["rate"] < self.max_rate:
+                state["rate"] = min(self.max_rate, state["rate"] + self.recovery_step)
+
+    def stats(self):
+        """Return the time spent throttled and the current rate."""
+        with self._locked_state() as state:
+            rate = state["rate"]
+        return {"throttled_seconds": self.throttled_seconds, "throttled_requests": self.throttled_requests, "requests_per_second": rate}
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given in seconds or as an HTTP date; returns seconds or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedSession(requests.Session):
+    """A requests session that sends every request through the shared rate limiter
+    and transparently retries requests the API rejected with 429 or 503."""
+
+    def __init__(self, limiter=None, max_retries=M3_API_RATE_LIMIT["max_retries"]):
+        super().__init__()
+        self.limiter = limiter or default_rate_limiter
+        self.max_retries = max_retries
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code not in THROTTLING_STATUS_CODES:
+                self.limiter.reward()
+                return response
+            if attempt == self.max_retries:
+                logger.error(f"{method} {url} still answered with {response.status_code} after {attempt + 1} attempts")
+                return response
+            self.limiter.penalize(parse_retry_after(response.headers.get('Retry-After')))
+            response.close()
+
+
+# Process-wide limiter shared by all DataDownloader, DataUploader and DataDeleter instances
+default_rate_limiter = TokenBucketRateLimiter(
+    M3_API_RATE_LIMIT["requests_per_second"],
+    M3_API_RATE_LIMIT["burst"],
+    lock_path=M3_API_RATE_LIMIT["lock_path"],
+)
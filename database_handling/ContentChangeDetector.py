@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from config import CONTENT_HASH_STORE_PATH, TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION, STAGE_INPUTS
+
+logger = logging.getLogger(__name__)
+
+# Analysis stages (method names as in STAGE_INPUTS) and the fields they produce per scraped input field.
+# Vectorization is split by input, so that a changed lead only resends lead_* vectors.
+STAGE_OUTPUTS_BY_INPUT = {
+    "extract_entities": {"main_text": ["central_entities"]},
+    "extract_topics": {"main_text": ["topic"]},
+    "vectorize": {"lead_text": [f"lead_{key}" for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION],
+                  "main_text": [f"full_{key}" for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION]},
+    "summarize": {"main_text": ["summary"]},
+}
+TEXT_FIELDS = ("main_text", "lead_text")
+ANALYSIS_FIELDS = {field for outputs in STAGE_OUTPUTS_BY_INPUT.values() for fields in outputs.values() for field in fields}
+# Fields that change on every scrape without the article changing
+VOLATILE_FIELDS = {"url", "last_online_verification_date"}
+
+class ContentChangeDetector:
+    """Detects changes of re-scraped articles through content hashes stored locally per URL.
+
+    For every uploaded article the hashes of its texts and scraped metadata fields are recorded.
+    When a known URL is scraped again, comparing the hashes tells which texts and fields changed,
+    which analysis stages have to run again, and which fields belong in a minimal patch_content diff.
+    """
+
+    def __init__(self, path=CONTENT_HASH_STORE_PATH):
+        """Initialize the detector with an SQLite file holding one row of hashes per URL."""
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS content_hashes (url TEXT PRIMARY KEY, hashes TEXT NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def _hash(value):
+        return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def fingerprint(self, article):
+        """Return the hashes of the texts and scraped metadata fields of an article."""
+        return {field: self._hash(value) for field, value in article.items()
+                if field not in VOLATILE_FIELDS and field not in ANALYSIS_FIELDS}
+
+    def _stored_fingerprint(self, url):
+        with self._lock:
+            row = self._connection.execute("SELECT hashes FROM content_hashes WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(self, articles):
+        """Store the fingerprints of articles that were uploaded or patched successfully.
+        Must be called before the texts are removed from the articles."""
+        rows = [(article["url"], json.dumps(self.fingerprint(article))) for article in articles]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO content_hashes (url, hashes) VALUES (?, ?)", rows)
+            self._connection.commit()
+
+    def detect_changes(self, article):
+        """Compare a re-scraped article with its stored fingerprint.
+
+        Returns:
+            set or None: The names of the changed fields, or None if the URL has no stored fingerprint
+            (it was uploaded before change detection existed). Such articles are treated as a new baseline.
+        """
+        stored = self._stored_fingerprint(article["url"])
+        if stored is None:
+            return None
+        current = self.fingerprint(article)
+        return {field for field in set(stored) | set(current) if stored.get(field) != current.get(field)}
+
+    @staticmethod
+    def stages_to_rerun(changed_fields):
+        """Return the analysis stages whose inputs are among the changed fields."""
+        return [stage for stage, inputs in STAGE_INPUTS.items() if changed_fields.intersection(inputs)]
+
+    @staticmethod
+    def build_patch(article, changed_fields):
+        """Build the minimal patch_content payload: changed metadata fields plus the outputs
+        of the stages that were re-run because one of their inputs changed."""
+        patch = {field: article.get(field) for field in changed_fields if field not in TEXT_FIELDS}
+        for outputs_by_input in STAGE_OUTPUTS_BY_INPUT.values():
+            for input_field, output_fields in outputs_by_input.items():
+                if input_field in changed_fields:
+                    patch.update({field: article[field] for field in output_fields if field in article})
+        patch["last_online_verification_date"] = article.get("last_online_verification_date")
+        return patch
+
+    def partition(self, articles):
+        """Split re-scraped articles into changed ones, unchanged ones and ones without a baseline.
+
+        Returns:
+            tuple: (list of (article, changed_fields) pairs, list of unchanged articles, list of articles without a baseline)
+        """
+        changed, unchanged, without_baseline = [], [], []
+        for article in articles:
+            changed_fields = self.detect_changes(article)
+            if changed_fields is None:
+                without_baseline.append(article)
+            elif changed_fields:
+                changed.append((article, changed_fields))
+            else:
+                unchanged.append(article)
+        logger.info(f"Change detection: {len(changed)} changed, {len(unchanged)} unchanged, {len(without_baseline)} without baseline")
+        return changed, unchanged, without_baseline
+
+    def close(self):
+        self._connection.close()
@@ -1,17 +1,29 @@
 from config import BASE_URLS
 from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.DataDownload import DataDownloader
+from database_handling.ApiTransport import RateLimitedSession
 import requests
 import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
 
 class DataDeleter:
     def __init__(self, auth_token):
         """Initialize the DataDelete class with a database connection."""
         self.base_url = BASE_URLS["m3-api-base"]
+        self.auth_token = auth_token
         self.headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json',
             'Authorization': f'Bearer {auth_token}'
         }
+        # A session reuses connections across requests; it also applies the shared rate limit
+        self.session = RateLimitedSession()
+        self.session.headers.update(self.headers)
 
     def _return_response(self, response):
         """Utility method to return the response."""
@@ -19,10 +31,10 @@ class DataDeleter:
             try:
                 return response.status_code
             except json.JSONDecodeError:
-                print("Error decoding JSON")
+                logger.error("Error decoding JSON")
                 return {"error": "JSON decoding error", "response_text": response}
         else:
-            print("Empty response received")
+            logger.warning("Empty response received")
             return {"error": "Empty response"}, response
 
     def _delete_data(self, endpoint, identifier=None):
@@ -32,10 +44,10 @@ class DataDeleter:
             url = f'{url}{identifier}'  # Correctly append the identifier to the URL path
         
         try:
-            response = requests.delete(url, headers=self.headers)
+            response = self.session.delete(url)
             response.raise_for_status()  # Raises an HTTPError if the status is 4xx, 5xx
         except requests.exceptions.RequestException as e:
-            print(f"An error occurred: {e}")
+            logger.error(f"An error occurred while deleting {url}: {e}")
             return {"error": str(e)}, None
         else:
             return self._return_response(response)
@@ -54,4 +66,85 @@ class DataDeleter:
 
     def delete_use(self, identifier):
         """Deletes use."""
-        return self._delete_data("api/v1/use/", identifier)
\ No newline at end of file
+        return self._delete_data("api/v1/use/", identifier)
+
+    def _delete_one(self, endpoint, identifier):
+        """Deletes a single identifier and returns a structured result."""
+        url = f'{self.base_url}{endpoint}{identifier}'
+        try:
+            response = self.session.delete(url)
+            response.raise_for_status()
+            return {"identifier": identifier, "status": "deleted", "status_code": response.status_code, "error": None}
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            return {"identifier": identifier, "status": "failed", "status_code": status_code, "error": str(e)}
+
+    def delete_bulk(self, endpoint, identifiers=None, filters=None, id_field="id",
+                    max_workers=8, requests_per_second=20, dry_run=False):
+        """Deletes many records of an endpoint ("content", "encounter", "use", "profile").
+
+        The records are given either as an iterable of identifiers or as a dict of filters, which is
+        resolved to identifiers through the paginated download API. Deletes run concurrently with at
+        most max_workers requests in flight and at most requests_per_second requests started per second.
+        The requests_per_second cap applies on top of the process-wide m3 API rate limit.
+        With dry_run=True nothing is deleted, the matches are only counted and listed.
+
+        Returns:
+            list: One dict per identifier with the keys identifier, status ("deleted", "failed" or
+                  "dry_run"), status_code and error.
+        """
+        if (identifiers is None) == (filters is None):
+            raise ValueError("Pass either identifiers or filters to delete_bulk")
+
+        if filters is not None:
+            data_downloader = DataDownloader(self.auth_token)
+            # Resolve all matches before deleting: the download pages by page number, and every delete
+            # would shift later records onto pages that were already read
+            identifiers = [item[id_field] for item in data_downloader.iter_data(endpoint, **filters)]
+            logger.info(f"Filters matched {len(identifiers)} records of {endpoint}")
+
+        endpoint_path = f"api/v1/{endpoint}/"
+
+        if dry_run:
+            results = [{"identifier": identifier, "status": "dry_run", "status_code": None, "error": None} for identifier in identifiers]
+            logger.info(f"Dry run: {len(results)} records of {endpoint} would be deleted")
+            return results
+
+        min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        next_start = time.monotonic()
+        rate_lock = threading.Lock()
+
+        def throttled_delete(identifier):
+            nonlocal next_start
+            # Reserve the next free start slot, then sleep until it is reached
+            with rate_lock:
+                start = max(next_start, time.monotonic())
+                next_start = start + min_interval
+            delay = start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            return self._delete_one(endpoint_path, identifier)
+
+        results = []
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit in windows, so that a huge iterable of identifiers does not queue all futures at once
+            pending = set()
+            for identifier in identifiers:
+                pending.add(executor.submit(throttled_delete, identifier))
+                if len(pending) >= max_workers * 4:
+                    done = next(as_completed(pending))
+                    pending.remove(done)
+                    results.append(done.result())
+            for future in as_completed(pending):
+                results.append(future.result())
+
+        failed = [result for result in results if result["status"] == "failed"]
+        logger.info(f"Deleted {len(results) - len(failed)} of {len(results)} records of {endpoint} in {time.time() - start_time:.2f} seconds")
+        for result in failed:
+            logger.error(f"Failed to delete {endpoint} {result['identifier']}: {result['error']}")
+        return results
+
+    def delete_content_bulk(self, identifiers=None, filters=None, **kwargs):
+        """Deletes many content records, see delete_bulk."""
+        return self.delete_bulk("content", identifiers=identifiers, filters=filters, **kwargs)
@@ -1,24 +1,33 @@
-from config import BASE_URLS
+from config import BASE_URLS, M3_API_PAGINATION
 from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.ReferenceDataCache import default_reference_cache
+from database_handling.ApiTransport import RateLimitedSession
 import requests
 import json
 import logging
 import time
-from typing import List
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Iterator, Dict, Any
 
 #TODO: Status code ausgeben, damit im final laufenden scraper script gechecked werden kann, ob der download erfolgreich war
 
 logger = logging.getLogger(__name__)
 
 class DataDownloader:
-    def __init__(self, auth_token):
-        """Initialize the DataDownloader with a database connection."""
+    def __init__(self, auth_token, reference_cache=None):
+        """Initialize the DataDownloader with a database connection.
+        Reference-data lookups go through the given cache, or the process-wide one by default."""
         self.base_url = BASE_URLS["m3-api-base"]
         self.headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json',
             'Authorization': f'Bearer {auth_token}'
         }
+        # A session keeps the connection alive across requests; it also applies the shared rate limit
+        self.session = RateLimitedSession()
+        self.session.headers.update(self.headers)
+        self.reference_cache = reference_cache or default_reference_cache
                 
 
     def _build_query(self, **params):
@@ -64,7 +73,7 @@ class DataDownloader:
             logger.debug(f"Requesting URL: {url}")
             logger.debug(f"With params: {query}")
             
-            response = requests.get(url, headers=self.headers, params=query)
+            response = self.session.get(url, params=query)
             response_time = time.time() - start_time
             logger.debug(f"Request took {response_time:.2f} seconds")
             
@@ -75,11 +84,188 @@ class DataDownloader:
         else:
             return self._return_response(response)
 
+    def _request_page(self, url, query):
+        """Sends a streaming GET request for a single page and returns the open response."""
+        response = self.session.get(url, params=query, stream=True)
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _iter_json_items(response, metadata=None, chunk_size=64 * 1024):
+        """Incrementally decodes the objects of the top-level 'items' array of a streamed response.
+
+        Only one chunk of the body plus the item currently being decoded is held in memory,
+        so a page is never materialized as a whole. The other top-level fields (the page
+        metadata) are stored in the optional metadata dict as soon as they have been read.
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        chunks = response.iter_content(chunk_size=chunk_size)
+        buffer = ''
+        position = 0
+        in_items = False
+        exhausted = False
+
+        def read_more():
+            nonlocal buffer, position, exhausted
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+            else:
+                buffer = buffer[position:] + text_decoder.decode(chunk)
+            position = 0
+
+        def read_metadata(text):
+            # The fields before or after the array, e.g. '{"total": 250, ' or ', "page": 1, "pages": 3}'
+            text = text.strip().strip('{},').strip()
+            if metadata is None or not text:
+                return
+            try:
+                metadata.update(json.loads('{' + text + '}'))
+            except json.JSONDecodeError:
+                logger.warning("Could not decode the page metadata of a response")
+
+        # The paginated endpoints return {"items": [...], ...}; seek to the start of the array.
+        # The fields before it are only a few bytes, so they are kept until the array is found
+        search_from = 0
+        while not in_items:
+            start = buffer.find('"items"', search_from)
+            if start != -1:
+                bracket = buffer.find('[', start)
+                if bracket != -1:
+                    read_metadata(buffer[:start])
+                    position = bracket + 1
+                    in_items = True
+                    break
+                search_from = start
+            else:
+                # Search again from a short tail in case the key is split across two chunks
+                search_from = max(0, len(buffer) - len('"items"'))
+            if exhausted:
+                return
+            read_more()
+
+        while True:
+            # Skip whitespace and separators between items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                if exhausted:
+                    raise ValueError("Unexpected end of response while reading items")
+                read_more()
+                continue
+            if buffer[position] == ']':
+                if metadata is not None:
+                    # The rest of the body only holds the page metadata
+                    while not exhausted:
+                        read_more()
+                    read_metadata(buffer[position + 1:])
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item is incomplete, read the next chunk and try again
+                if exhausted:
+                    raise
+                read_more()
+                continue
+            position = end
+            yield item
+
+    @staticmethod
+    def _has_more_pages(metadata, page, page_size, item_count=None):
+        """Tells whether pages after the given one exist.
+
+        The page metadata of the response ('pages', or 'total' and 'size') decides; without it
+        a page is taken to be followed by another one when it came back full. Returns None if
+        neither the metadata nor an item count are available.
+        """
+        pages = metadata.get(M3_API_PAGINATION["pages_field"])
+        if isinstance(pages, int):
+            return page < pages
+        # The server may cap the requested page size, so prefer the size it reports
+        size = metadata.get(M3_API_PAGINATION["size_field"])
+        if not isinstance(size, int) or size <= 0:
+            size = page_size
+        total = metadata.get(M3_API_PAGINATION["total_field"])
+        if isinstance(total, int):
+            return (page - M3_API_PAGINATION["first_page"] + 1) * size < total
+        if item_count is None:
+            return None
+        return item_count >= size
+
+    def _iter_pages(self, endpoint, page_size=None, prefetch=True, **params) -> Iterator[Dict[str, Any]]:
+        """Yields the items of a paginated endpoint one by one.
+
+        Once the next page is known to exist, either from the page metadata of a response or
+        because the current page came back full, its request is sent in a background thread
+        while the items of the current page are still consumed. Iteration stops at the page
+        the metadata marks as the last one, or else at the first page that is not full.
+        """
+        url = f'{self.base_url}{endpoint}'
+        page_size = page_size or M3_API_PAGINATION["page_size"]
+        page = M3_API_PAGINATION["first_page"]
+
+        def query_for(page_number):
+            return self._build_query(**params, **{
+                M3_API_PAGINATION["page_param"]: page_number,
+                M3_API_PAGINATION["size_param"]: page_size,
+            })
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._request_page, url, query_for(page))
+            previous_metadata = {}
+            try:
+                while True:
+                    start_time = time.time()
+                    response = pending.result()
+                    pending = None
+                    # 'pages' and 'total' describe the whole listing, so the previous page's metadata
+                    # already tells whether the page after this one exists
+                    if prefetch and self._has_more_pages(previous_metadata, page, page_size):
+                        pending = executor.submit(self._request_page, url, query_for(page + 1))
+
+                    metadata = {}
+                    item_count = 0
+                    try:
+                        for item in self._iter_json_items(response, metadata):
+                            item_count += 1
+                            # Until this page's metadata has been read, the previous one still applies
+                            if prefetch and pending is None and self._has_more_pages(
+                                    metadata or previous_metadata, page, page_size, item_count):
+                                pending = executor.submit(self._request_page, url, query_for(page + 1))
+                            yield item
+                    finally:
+                        response.close()
+                        logger.debug(f"Page {page} of {endpoint} yielded {item_count} items in {time.time() - start_time:.2f} seconds")
+
+                    if not self._has_more_pages(metadata, page, page_size, item_count):
+                        return
+
+                    previous_metadata = metadata
+                    page += 1
+                    if pending is None:
+                        pending = executor.submit(self._request_page, url, query_for(page))
+            finally:
+                # A prefetched page that is no longer needed (end of collection or the caller
+                # stopped early) still has to release its connection
+                if pending is not None:
+                    pending.add_done_callback(lambda future: future.exception() or future.result().close())
+
+    def _get_cached_data(self, endpoint):
+        """Fetches a reference-data endpoint through the TTL cache."""
+        return self.reference_cache.get(endpoint, lambda: self._get_data(endpoint))
+
+    def invalidate_reference_cache(self, endpoint=None):
+        """Invalidates the cached reference data of one endpoint (e.g. "api/v1/content/topic/") or of all endpoints."""
+        self.reference_cache.invalidate(endpoint)
+
     def _get_data_status_code_only(self, endpoint, **params):
         """Sends a GET request to the specified endpoint and returns only the status code."""
         url = f'{self.base_url}{endpoint}'
         try:
-            response = requests.get(url, headers=self.headers, params=params, stream=False, timeout=1)
+            response = self.session.get(url, params=params, stream=False, timeout=1)
             return response.status_code
         except requests.exceptions.RequestException as e:
             logger.error(f"An error occurred while checking {url}: {e}")
@@ -103,13 +289,30 @@ class DataDownloader:
         url_list = [item['url'] for item in full_result_dictionary['items']]
         return url_list
 
+    def iter_content(self, page_size=None, prefetch=True, **params):
+        """Iterates over all content items matching the optional filters, page by page."""
+        return self._iter_pages("api/v1/content/", page_size=page_size, prefetch=prefetch, **params)
+
+    def iter_only_urls(self, page_size=None, prefetch=True, **params):
+        """Iterates over the URLs of all content items matching the optional filters."""
+        for item in self.iter_content(page_size=page_size, prefetch=prefetch, **params):
+            yield item['url']
+
     def get_encounter(self, **params):
         """Fetches encounters with optional filters."""
         return self._get_data("api/v1/encounter/", **params)
         
+    def iter_encounter(self, page_size=None, prefetch=True, **params):
+        """Iterates over all encounters matching the optional filters, page by page."""
+        return self._iter_pages("api/v1/encounter/", page_size=page_size, prefetch=prefetch, **params)
+
     def get_use(self, **params):
         """Fetches uses with optional filters."""
         return self._get_data("api/v1/use/", **params)
+
+    def iter_use(self, page_size=None, prefetch=True, **params):
+        """Iterates over all uses matching the optional filters, page by page."""
+        return self._iter_pages("api/v1/use/", page_size=page_size, prefetch=prefetch, **params)
     
     def get_content_rehydrate(self, **params):
         """Gets content rehydrate with optional filters."""
@@ -143,27 +346,27 @@ class DataDownloader:
 
     def get_content_entitytype(self):
         """Gets content entitytype."""
-        return self._get_data("api/v1/content/entitytype/")
+        return self._get_cached_data("api/v1/content/entitytype/")
 
     def get_content_medium(self):
         """Gets content medium."""
-        return self._get_data("api/v1/content/medium/")
+        return self._get_cached_data("api/v1/content/medium/")
 
     def get_content_topic(self):
         """Gets content topic."""
-        return self._get_data("api/v1/content/topic/")
+        return self._get_cached_data("api/v1/content/topic/")
 
     def get_use_channel(self):
         """Gets use channel."""
-        return self._get_data("api/v1/use/channel/")
+        return self._get_cached_data("api/v1/use/channel/")
 
     def get_use_device(self):
         """Gets use device."""
-        return self._get_data("api/v1/use/device/")
+        return self._get_cached_data("api/v1/use/device/")
 
     def get_use_survey(self):
         """Gets use survey."""
-        return self._get_data("api/v1/use/survey/")
+        return self._get_cached_data("api/v1/use/survey/")
     
     def get_data(self, endpoint, **params):
         """Fetches data from a specified endpoint with optional filters.
@@ -171,3 +374,7 @@ class DataDownloader:
         The other endpoint-specific methods are kept for convenience."""
         return self._get_data(f"api/v1/{endpoint}/", **params)
 
+    def iter_data(self, endpoint, page_size=None, prefetch=True, **params):
+        """Iterates over all items of a specified paginated endpoint, page by page.
+        The streaming counterpart of get_data for walking complete collections."""
+        return self._iter_pages(f"api/v1/{endpoint}/", page_size=page_size, prefetch=prefetch, **params)
@@ -1,7 +1,6 @@
 from config import BASE_URLS
 from database_handling.DataUpload import DataUploader
 from database_handling.DataDownload import DataDownloader
-from datetime import datetime
 
 # TODO: Neuen Namen für die Klasse finden
 class DataHandler:
@@ -40,14 +39,7 @@ class DataHandler:
         
     
     def patch_last_online_verification_date(self, auth_token, scraped_urls_already_in_db):
-        """Update the last online verification date in a content_dict"""
+        """Update the last online verification date in a content_dict.
+        Delegates to the chunked, concurrent bulk patch of the DataUploader and returns its per-URL outcomes."""
         data_uploader = DataUploader(auth_token)
-        
-        responses = []
-    
-        new_last_online_verification_date = datetime.now().isoformat()
-        for url in scraped_urls_already_in_db:
-            response = data_uploader.patch_content(url=url, data={"last_online_verification_date": new_last_online_verification_date})
-            responses.append(response)
-        
-        return responses
\ No newline at end of file
+        return data_uploader.patch_last_online_verification_date_bulk(scraped_urls_already_in_db)
\ No newline at end of file
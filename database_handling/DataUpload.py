@@ -1,9 +1,17 @@
 from config import BASE_URLS
 from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.ApiTransport import RateLimitedSession, THROTTLING_STATUS_CODES
+from kafka_queue.wire_format import json_default
 import requests
 import json
+import logging
+import time
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime  # Ensure datetime is imported
 
+logger = logging.getLogger(__name__)
+
 class DataUploader:
     def __init__(self, auth_token):
         """Initialize the DataUploader with a database connection."""
@@ -13,6 +21,9 @@ class DataUploader:
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {auth_token}'
         }
+        # A session reuses connections across requests; it also applies the shared rate limit
+        self.session = RateLimitedSession()
+        self.session.headers.update(self.headers)
 
     def _build_query(self, **filters):
         """Utility method to build query string from filters."""
@@ -37,55 +48,137 @@ class DataUploader:
     def post_profile(self, data):
         """Uploads profile information."""
         url = f'{self.base_url}api/v1/profile/'
-        response = requests.post(url, headers=self.headers, data=json.dumps(data))
+        response = self.session.post(url, data=json.dumps(data, default=json_default))
         return self._return_response(response)
 
-    def post_content(self, data):
-        """Uploads content."""
+    def post_content(self, data, raise_for_status=False):
+        """Uploads content.
+        With raise_for_status=True an HTTPError is raised for 4xx/5xx responses instead of returning the error body."""
         url = f'{self.base_url}api/v1/content/'
-        response = requests.post(url, headers=self.headers, data=json.dumps(data))
+        response = self.session.post(url, data=json.dumps(data, default=json_default))
+        if raise_for_status:
+            response.raise_for_status()
         return self._return_response(response)
 
     def post_use(self, data):
         """Uploads use."""
         url = f'{self.base_url}api/v1/use/'
-        response = requests.post(url, headers=self.headers, data=json.dumps(data))
+        response = self.session.post(url, data=json.dumps(data, default=json_default))
         return self._return_response(response)
 
     def post_encounter(self, data):
         """Uploads encounter."""
         url = f'{self.base_url}api/v1/encounter/'
-        response = requests.post(url, headers=self.headers, data=json.dumps(data))
+        response = self.session.post(url, data=json.dumps(data, default=json_default))
         return self._return_response(response)
 
-    def patch_content(self, data, **params):
-        """Patches content with given parameters and data."""
+    def patch_content(self, data, raise_for_status=False, **params):
+        """Patches content with given parameters and data.
+        With raise_for_status=True an HTTPError is raised for 4xx/5xx responses instead of returning the error body."""
         url = f'{self.base_url}api/v1/content/'
-        response = requests.patch(url, headers=self.headers, params=params, data=json.dumps(data))
+        response = self.session.patch(url, params=params, data=json.dumps(data, default=json_default))
+        if raise_for_status:
+            response.raise_for_status()
         return self._return_response(response)
 
     def patch_use(self, data, **params):
         """Patches use with given parameters and data."""
         url = f'{self.base_url}api/v1/use/'
-        response = requests.patch(url, headers=self.headers, params=params, data=json.dumps(data))
+        response = self.session.patch(url, params=params, data=json.dumps(data, default=json_default))
         return self._return_response(response)
 
     def patch_encounter(self, data, **params):
         """Patches encounter with given parameters and data."""
         url = f'{self.base_url}api/v1/encounter/'
-        response = requests.patch(url, headers=self.headers, params=params, data=json.dumps(data))
+        response = self.session.patch(url, params=params, data=json.dumps(data, default=json_default))
         return self._return_response(response)
     
     def patch_last_online_verification_date(self, scraped_urls_already_in_db):
-        """Update the last online verification date in content."""
+        """Update the last online verification date in content.
+        The URLs are patched in size-bounded chunks, see patch_last_online_verification_date_bulk."""
+        outcomes = self.patch_last_online_verification_date_bulk(scraped_urls_already_in_db)
+        # Keep the previous return format: one response per PATCH request
         responses = []
+        seen_chunks = set()
+        for outcome in outcomes.values():
+            if outcome["chunk"] not in seen_chunks:
+                seen_chunks.add(outcome["chunk"])
+                responses.append(outcome["response"])
+        return responses
+
+    @staticmethod
+    def _chunk_urls(urls, max_query_length, max_chunk_size):
+        """Split URLs into chunks whose encoded url= query stays below max_query_length characters."""
+        chunks = []
+        current_chunk, current_length = [], 0
+        for url in urls:
+            # Every URL is sent as its own "&url=<encoded>" parameter
+            parameter_length = len(quote(url, safe='')) + len('&url=')
+            if current_chunk and (current_length + parameter_length > max_query_length or len(current_chunk) >= max_chunk_size):
+                chunks.append(current_chunk)
+                current_chunk, current_length = [], 0
+            current_chunk.append(url)
+            current_length += parameter_length
+        if current_chunk:
+            chunks.append(current_chunk)
+        return chunks
+
+    def _patch_verification_chunk(self, chunk, verification_date, retries, backoff):
+        """PATCH the verification date for one chunk of URLs, retrying with exponential backoff.
+        429/503 responses are already retried by the rate-limited session and are not retried again here.
+        Returns the parsed response and the number of attempts, raises the last error if all attempts failed."""
+        url = f'{self.base_url}api/v1/content/'
+        for attempt in range(1, retries + 2):
+            try:
+                response = self.session.patch(url, params={"url": chunk}, data=json.dumps({"last_online_verification_date": verification_date}))
+                response.raise_for_status()
+                return self._return_response(response), attempt
+            except requests.exceptions.RequestException as e:
+                throttled = isinstance(e, requests.exceptions.HTTPError) and e.response is not None \
+                    and e.response.status_code in THROTTLING_STATUS_CODES
+                if attempt > retries or throttled:
+                    raise
+                delay = backoff * 2 ** (attempt - 1)
+                logger.warning(f"Patching a chunk of {len(chunk)} URLs failed (attempt {attempt}), retrying in {delay:.1f} seconds: {e}")
+                time.sleep(delay)
+
+    def patch_last_online_verification_date_bulk(self, urls, max_query_length=6000, max_chunk_size=200, max_workers=8, retries=3, backoff=1.0):
+        """Update the last online verification date for many URLs at once.
+
+        The URLs are split into chunks whose query string stays below max_query_length, the chunks
+        are patched concurrently and failed chunks are retried. All URLs share one verification date.
+
+        Returns:
+            dict: URL -> {"status": "patched" | "failed", "attempts": int, "error": str | None,
+                          "chunk": index of the chunk, "response": parsed response of the chunk}
+        """
+        urls = list(dict.fromkeys(urls))  # Deduplicate while keeping the order
+        if not urls:
+            return {}
 
-        # Generate a new verification date
         new_last_online_verification_date = datetime.now().isoformat()
-        
-        # Iterate over each URL and patch the content
-        # for url in scraped_urls_already_in_db:
-        response = self.patch_content(data={"last_online_verification_date": new_last_online_verification_date}, url=scraped_urls_already_in_db)
-        responses.append(response)
+        chunks = self._chunk_urls(urls, max_query_length, max_chunk_size)
+        logger.info(f"Patching last online verification date for {len(urls)} URLs in {len(chunks)} chunks")
+        start_time = time.time()
 
-        return responses
+        outcomes = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._patch_verification_chunk, chunk, new_last_online_verification_date, retries, backoff): index
+                for index, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    response, attempts = future.result()
+                    outcome = {"status": "patched", "attempts": attempts, "error": None}
+                except Exception as e:
+                    logger.error(f"Patching chunk {index + 1} of {len(chunks)} failed: {e}")
+                    response = None
+                    outcome = {"status": "failed", "attempts": retries + 1, "error": str(e)}
+                for url in chunks[index]:
+                    outcomes[url] = {**outcome, "chunk": index, "response": response}
+
+        failed = sum(1 for outcome in outcomes.values() if outcome["status"] == "failed")
+        logger.info(f"Patched {len(urls) - failed} of {len(urls)} URLs in {time.time() - start_time:.2f} seconds ({failed} failed)")
+        return outcomes
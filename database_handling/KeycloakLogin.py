@@ -2,18 +2,18 @@ import os
 import logging
 from datetime import datetime, timedelta
 from keycloak import KeycloakOpenID
-from config import KEYCLOAK_CREDENTIALS_PATH
+from config import KEYCLOAK_CREDENTIALS_PATH, BASE_URLS
 
 # Set up logging for the scraper to track events and errors
 logger = logging.getLogger(__name__)
 
 class KeycloakLogin:
-    def __init__(self):
+    def __init__(self, credentials_path=KEYCLOAK_CREDENTIALS_PATH):
         logging.debug("Initializing KeycloakLogin class")
-        self.server_url = "https://login.m3.ifkw.lmu.de/auth/"
+        self.server_url = BASE_URLS["m3-login-base"]
         self.realm_name = 'm3-api'
         self.client_id = 'm3-api'
-        self.keycloak_credentials = KEYCLOAK_CREDENTIALS_PATH
+        self.keycloak_credentials = credentials_path
         self.username = None
         self.password = None
         self._load_credentials()
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from config import REFERENCE_DATA_CACHE_TTL, REFERENCE_DATA_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+class ReferenceDataCache:
+    """A TTL cache for the small, rarely changing lookup tables of the m3 API
+    (media, entity types, topics, channels, devices, surveys).
+
+    Entries live in memory and are optionally persisted to a JSON file, so that
+    consecutive runs can start without fetching the tables again.
+    """
+
+    def __init__(self, ttl=REFERENCE_DATA_CACHE_TTL, path=REFERENCE_DATA_CACHE_PATH):
+        """Initialize the cache with a time-to-live in seconds and an optional file path for persistence."""
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loaded_from_disk = False
+
+    def _load(self):
+        """Load persisted entries once, ignoring a missing or unreadable file."""
+        if self._loaded_from_disk or not self.path:
+            return
+        self._loaded_from_disk = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            logger.debug(f"Loaded {len(self._entries)} reference data entries from {self.path}")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read reference data cache {self.path}: {e}")
+            self._entries = {}
+
+    def _persist(self):
+        """Write all entries to disk atomically so that a crash never leaves a truncated file."""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False) as f:
+                json.dump(self._entries, f)
+                temp_path = f.name
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write reference data cache {self.path}: {e}")
+
+    def get(self, endpoint, fetch):
+        """Return the cached value for an endpoint, calling fetch() if it is missing or expired.
+
+        Failed fetches (None) are not cached, so the next call tries again.
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(endpoint)
+            if entry is not None and time.time() - entry["fetched_at"] < self.ttl:
+                return entry["data"]
+
+            data = fetch()
+            if data is None:
+                logger.warning(f"Fetching reference data from {endpoint} failed, nothing cached")
+                return entry["data"] if entry is not None else None
+
+            self._entries[endpoint] = {"fetched_at": time.time(), "data": data}
+            self._persist()
+            logger.debug(f"Cached reference data from {endpoint} for {self.ttl} seconds")
+            return data
+
+    def invalidate(self, endpoint=None):
+        """Drop the entry of a single endpoint, or all entries if no endpoint is given."""
+        with self._lock:
+            self._load()
+            if endpoint is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(endpoint, None)
+            self._persist()
+        logger.info(f"Invalidated reference data cache for {endpoint or 'all endpoints'}")
+
+
+# Process-wide cache shared by all DataDownloader instances, which are re-created whenever the token is refreshed
+default_reference_cache = ReferenceDataCache()
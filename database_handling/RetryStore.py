@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from kafka_queue.wire_format import json_default
+from config import RETRY_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_STAGE = "upload"
+
+class RetryStore:
+    """Retry budgets and dead letters for articles that failed in an analysis stage or at upload.
+
+    A failed article is stored with its attempt count and becomes due again after an exponentially
+    growing delay. Once it used up max_attempts it is moved to the dead letters, where it stays until
+    it is replayed (see replay_dead_letters.py). The store is an SQLite file, so all worker processes
+    on a machine share it. Due articles are leased while they are retried, so that two workers never
+    pick the same one; a worker that crashes during a retry lets the lease run out.
+    """
+
+    def __init__(self, path=RETRY_SETTINGS["path"], max_attempts=RETRY_SETTINGS["max_attempts"],
+                 base_delay=RETRY_SETTINGS["base_delay_seconds"], max_delay=RETRY_SETTINGS["max_delay_seconds"]):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # The timeout lets concurrent writers of other worker processes wait for the file lock
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS failures (
+            url TEXT PRIMARY KEY, stage TEXT, article TEXT, attempts INTEGER, next_attempt_at REAL,
+            last_error TEXT, dead INTEGER DEFAULT 0, updated_at REAL)""")
+
+    def delay(self, attempts):
+        """Seconds to wait before the next attempt after the given number of failed attempts."""
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def record_failure(self, article, stage, error):
+        """Count a failed attempt of an article. Returns True if it still has attempts left,
+        False if it was moved to the dead letters."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            row = self._connection.execute("SELECT attempts FROM failures WHERE url = ?", (article['url'],)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            dead = attempts >= self.max_attempts
+            self._connection.execute(
+                "INSERT OR REPLACE INTO failures (url, stage, article, attempts, next_attempt_at, last_error, dead, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (article['url'], stage, json.dumps(article, default=json_default), attempts, now + self.delay(attempts), str(error), int(dead), now))
+            self._connection.execute("COMMIT")
+        if dead:
+            logger.error(f"Article {article['url']} failed {attempts} times, last in {stage}, moved to the dead letters: {error}")
+        else:
+            logger.warning(f"Article {article['url']} failed in {stage} (attempt {attempts} of {self.max_attempts}), "
+                           f"retrying in {self.delay(attempts):.0f} seconds: {error}")
+        return not dead
+
+    def claim_due(self, limit=100, lease=None):
+        """Return up to limit articles whose analysis retry is due and lease them for lease seconds
+        (default: max_delay). Failed uploads stay in the upload spool, which checks is_waiting()."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            rows = self._connection.execute(
+                "SELECT url, article FROM failures WHERE dead = 0 AND next_attempt_at <= ? AND stage != ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, UPLOAD_STAGE, limit)).fetchall()
+            self._connection.executemany("UPDATE failures SET next_attempt_at = ? WHERE url = ?",
+                                         [(now + (lease or self.max_delay), url) for url, _ in rows])
+            self._connection.execute("COMMIT")
+        if rows:
+            logger.info(f"Claimed {len(rows)} due analysis retries")
+        return [json.loads(article) for _, article in rows]
+
+    def is_waiting(self, url):
+        """Whether an article waits for its next attempt or is dead-lettered, i.e. must not be tried now."""
+        with self._lock:
+            row = self._connection.execute("SELECT dead, next_attempt_at FROM failures WHERE url = ?", (url,)).fetchone()
+        return row is not None and (row[0] == 1 or row[1] > time.time())
+
+    def resolve(self, urls):
+        """Forget the failures of articles that succeeded."""
+        urls = list(urls)
+        with self._lock:
+            self._connection.executemany("DELETE FROM failures WHERE url = ? AND dead = 0", [(url,) for url in urls])
+
+    def dead_letters(self, stage=None, urls=None):
+        """Return the dead letters as dicts with url, stage, attempts, last_error, updated_at and article."""
+        query = "SELECT url, stage, attempts, last_error, updated_at, article FROM failures WHERE dead = 1"
+        params = []
+        if stage is not None:
+            query += " AND stage = ?"
+            params.append(stage)
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        letters = [{"url": url, "stage": stage, "attempts": attempts, "last_error": last_error, "updated_at": updated_at,
+                    "article": json.loads(article)} for url, stage, attempts, last_error, updated_at, article in rows]
+        if urls is not None:
+            urls = set(urls)
+            letters = [letter for letter in letters if letter["url"] in urls]
+        return letters
+
+    def remove(self, urls):
+        """Delete articles from the store, e.g. dead letters that were replayed."""
+        urls = list(urls)
+        with self._lock:
+            self._connection.executemany("DELETE FROM failures WHERE url = ?", [(url,) for url in urls])
+
+    def stats(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT dead, COUNT(*) FROM failures GROUP BY dead").fetchall()
+        counts = dict(rows)
+        return {"retrying": counts.get(0, 0), "dead": counts.get(1, 0)}
+
+    def close(self):
+        self._connection.close()
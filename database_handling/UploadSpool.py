@@ -0,0 +1,122 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from kafka_queue.wire_format import json_default
+from config import UPLOAD_SPOOL_PATH
+
+logger = logging.getLogger(__name__)
+
+class UploadSpool:
+    """A durable, append-only write-ahead log for processed articles awaiting upload.
+
+    Every processed article is appended to the spool before it is posted, and an
+    acknowledgement record is appended once the API accepted it. Whatever is not
+    acknowledged survives crashes and API outages and can be replayed later with
+    drain_spool.py, so the NLP stages never have to run twice for the same article.
+
+    Each line of the spool file is a JSON record, either
+    {"op": "put", "id": ..., "article": {...}} or {"op": "ack", "id": ...}.
+
+    Several processes may share a spool (e.g. scrape_analyze_upload.py and drain_spool.py); every
+    access holds an flock on <path>.lock, which, unlike the spool file, is not replaced by compact().
+    """
+
+    def __init__(self, path=UPLOAD_SPOOL_PATH):
+        """Initialize the spool, creating the directory of the spool file if necessary."""
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._terminate_torn_line()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the spool exclusively, against other threads and other processes."""
+        with self._lock:
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _terminate_torn_line(self):
+        """Terminate a partial last line left by a crash, so that new records start on a fresh line."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+    @staticmethod
+    def article_id(article):
+        """Return a stable identifier for an article, derived from its URL."""
+        return hashlib.sha1(article['url'].encode('utf-8')).hexdigest()
+
+    def _append(self, records):
+        """Append records and fsync, so that they are on disk before the caller continues."""
+        with self._locked():
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, default=json_default) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, articles):
+        """Write processed articles to the spool and return their identifiers."""
+        records = [{"op": "put", "id": self.article_id(article), "article": article} for article in articles]
+        self._append(records)
+        logger.debug(f"Spooled {len(records)} articles to {self.path}")
+        return [record["id"] for record in records]
+
+    def ack(self, article_id):
+        """Mark a spooled article as successfully uploaded."""
+        self._append([{"op": "ack", "id": article_id}])
+
+    def _read(self):
+        """Yield all intact records; a torn last line from a crash during a write is skipped."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt record in line {line_number} of {self.path}")
+
+    def pending(self):
+        """Return a dict of identifier -> article for all spooled articles that were not acknowledged.
+        If an article was spooled several times, the latest version wins."""
+        with self._locked():
+            return self._pending()
+
+    def _pending(self):
+        pending = {}
+        for record in self._read():
+            if record["op"] == "put":
+                pending[record["id"]] = record["article"]
+            elif record["op"] == "ack":
+                pending.pop(record["id"], None)
+        return pending
+
+    def compact(self):
+        """Rewrite the spool so that it only contains the pending articles."""
+        temp_path = f"{self.path}.tmp"
+        # Reading and replacing under one lock, so that no record appended in between is lost
+        with self._locked():
+            pending = self._pending()
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for article_id, article in pending.items():
+                    f.write(json.dumps({"op": "put", "id": article_id, "article": article}, default=json_default) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        logger.info(f"Compacted upload spool to {len(pending)} pending articles")
+        return len(pending)
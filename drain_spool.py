@@ -0,0 +1,78 @@
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database_handling.DataUpload import DataUploader
+from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.UploadSpool import UploadSpool
+from database_handling.RetryStore import RetryStore, UPLOAD_STAGE
+from config import UPLOAD_SPOOL_PATH
+
+def configure_logging(log_level):
+    logging.basicConfig(
+        level=getattr(logging, log_level.upper(), logging.INFO),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("drain_spool.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+def drain_spool(spool, concurrency=8, retry_store=None):
+    """Upload all pending articles of the spool concurrently and acknowledge the successful ones.
+    Articles whose retry delay has not passed yet are skipped; articles that run out of attempts
+    are moved to the dead letters. Returns the number of uploaded and failed articles."""
+    logger = logging.getLogger(__name__)
+    retry_store = retry_store or RetryStore()
+    pending = {article_id: article for article_id, article in spool.pending().items()
+               if not retry_store.is_waiting(article['url'])}
+    logger.info(f"Draining {len(pending)} pending articles from {spool.path} with {concurrency} workers")
+
+    keycloak_login = KeycloakLogin()
+    token_lock = threading.Lock()
+    # One uploader, and with it one HTTP session, for the whole drain
+    current_token = keycloak_login.get_token()
+    data_uploader = DataUploader(current_token)
+
+    def upload(article_id, article):
+        nonlocal current_token
+        # KeycloakLogin refreshes the token in place, so it must not be used by several threads at once;
+        # get_token() only logs in again once the token expired
+        with token_lock:
+            token = keycloak_login.get_token()
+            if token != current_token:
+                current_token = token
+                data_uploader.session.headers['Authorization'] = f'Bearer {token}'
+        data_uploader.post_content(article, raise_for_status=True)
+        spool.ack(article_id)
+        retry_store.resolve([article['url']])
+
+    uploaded, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(upload, article_id, article): (article_id, article) for article_id, article in pending.items()}
+        for future in as_completed(futures):
+            article_id, article = futures[future]
+            try:
+                future.result()
+                uploaded += 1
+                logger.info(f"Successfully uploaded article: {article.get('url', 'N/A')}")
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error uploading article {article.get('url', 'N/A')}: {str(e)}")
+                if not retry_store.record_failure(article, UPLOAD_STAGE, e):
+                    # Out of attempts: the article now lives in the dead letters instead of the spool
+                    spool.ack(article_id)
+
+    spool.compact()
+    logger.info(f"Spool drained: {uploaded} uploaded, {failed} still pending")
+    return uploaded, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload the processed articles left in the upload spool.")
+    parser.add_argument("-s", "--spool", default=UPLOAD_SPOOL_PATH, help=f"Path of the spool file (default: {UPLOAD_SPOOL_PATH})")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of parallel uploads (default: 8)")
+    parser.add_argument("-l", "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level (default: INFO)")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    drain_spool(UploadSpool(args.spool), args.concurrency)
@@ -0,0 +1,92 @@
+import argparse
+import copy
+import gc
+import json
+import logging
+import time
+
+import numpy as np
+
+from text_analysis.NEExtractor import NEExtractor
+from text_analysis.Summarizer import Summarizer
+from text_analysis.TopicExtractor import TopicExtractor
+from text_analysis.Vectorizers import Vectorizer
+from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION
+
+FIXTURE_ARTICLES_PATH = "text_analysis/fixtures/articles.jsonl"
+
+STAGES = {
+    "ner": (NEExtractor, "extract_entities"),
+    "topics": (TopicExtractor, "extract_topics"),
+    "vectors": (Vectorizer, "vectorize"),
+    "summary": (Summarizer, "summarize"),
+}
+
+def load_articles(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run_stage(text_analysis_class, method_name, articles, quantize):
+    """Run a stage on copies of the articles; returns the results and the inference time in seconds."""
+    processor = text_analysis_class(quantize=quantize)
+    articles = copy.deepcopy(articles)
+    start = time.perf_counter()
+    results = getattr(processor, method_name)(articles)
+    elapsed = time.perf_counter() - start
+    del processor
+    gc.collect()
+    return results, elapsed
+
+def f1(reference, candidate):
+    reference, candidate = set(reference), set(candidate)
+    if not reference and not candidate:
+        return 1.0
+    overlap = len(reference & candidate)
+    return 2 * overlap / (len(reference) + len(candidate))
+
+def cosine(a, b):
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    if not a.size or not b.size:
+        return 1.0 if a.size == b.size else 0.0
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+def compare(stage, reference, quantized):
+    """Accuracy of the quantized results, measured against the full-precision results."""
+    if stage == "ner":
+        scores = [f1([(e["title"], e["type_id"]) for e in r["central_entities"]], [(e["title"], e["type_id"]) for e in q["central_entities"]])
+                  for r, q in zip(reference, quantized)]
+        return {"entity_f1": float(np.mean(scores))}
+    if stage == "topics":
+        return {"topic_agreement": float(np.mean([r["topic"] == q["topic"] for r, q in zip(reference, quantized)]))}
+    if stage == "vectors":
+        similarities = {f"{prefix}_{key}": [cosine(r[f"{prefix}_{key}"], q[f"{prefix}_{key}"]) for r, q in zip(reference, quantized)]
+                        for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION for prefix in ("lead", "full")}
+        return {"min_cosine": {field: float(np.min(values)) for field, values in similarities.items()},
+                "mean_cosine": float(np.mean([np.mean(values) for values in similarities.values()]))}
+    if stage == "summary":
+        return {"summary_unigram_f1": float(np.mean([f1(r["summary"].lower().split(), q["summary"].lower().split())
+                                                     for r, q in zip(reference, quantized)]))}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the int8 CPU profile of the analysis stages with full precision on a fixture set.")
+    parser.add_argument("-a", "--articles", default=FIXTURE_ARTICLES_PATH, help=f"JSON lines file of articles (default: {FIXTURE_ARTICLES_PATH})")
+    parser.add_argument("-s", "--stages", nargs="+", default=list(STAGES), choices=list(STAGES), help="Stages to evaluate (default: all)")
+    parser.add_argument("-o", "--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    articles = load_articles(args.articles)
+    report = {}
+    for stage in args.stages:
+        text_analysis_class, method_name = STAGES[stage]
+        logging.info(f"Evaluating {stage} on {len(articles)} articles")
+        reference, reference_seconds = run_stage(text_analysis_class, method_name, articles, quantize=False)
+        quantized, quantized_seconds = run_stage(text_analysis_class, method_name, articles, quantize=True)
+        report[stage] = {"full_precision_seconds": round(reference_seconds, 3), "int8_seconds": round(quantized_seconds, 3),
+                         "speedup": round(reference_seconds / quantized_seconds, 2), **compare(stage, reference, quantized)}
+        logging.info(f"{stage}: {report[stage]}")
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,250 @@
+import abc
+import hashlib
+import logging
+import threading
+import time
+from config import KAFKA_CONSUMER_SETTINGS
+
+class BaseQueue(abc.ABC):
+    """The queue interface of the pipeline: an article topic and a processed topic, each read by a consumer
+    group, with micro-batch consumption and manual offset commits.
+
+    Backends implement _create_producer(), _create_consumer() and _commit(). Their producers and consumers
+    follow the kafka-python API: send() returns a future with add_callback()/add_errback()/succeeded(),
+    poll() returns {partition: records} where records have an offset and a value, and partitions have a topic."""
+
+    def __init__(self, topic='raw_articles', processed_topic='processed_article_queue', flush_each_message=False, manual_commit=False,
+                 group_id='article_group', processed_group_id='processed_article_group'):
+        self.topic = topic
+        self.processed_topic = processed_topic
+        self.group_id = group_id
+        self.processed_group_id = processed_group_id
+        self.flush_each_message = flush_each_message
+        self.manual_commit = manual_commit
+        self._commit_lock = threading.Lock()
+        self._marked_offsets = {}
+        self._marked_batches = 0
+        self._last_commit = time.monotonic()
+        self._metrics_lock = threading.Lock()
+        self.delivery_metrics = {"sent": 0, "delivered": 0, "failed": 0, "bytes": 0}
+        # Connections are opened on first use, so that a producer-only process (like scrape.py)
+        # never joins a consumer group and a consumer-only process never opens a producer
+        self._connection_lock = threading.Lock()
+        self._producer = None
+        self._consumer = None
+        self._processed_consumer = None
+
+    @abc.abstractmethod
+    def _create_producer(self):
+        """Return a new producer."""
+
+    @abc.abstractmethod
+    def _create_consumer(self, topic, group_id):
+        """Return a new consumer of a topic in a consumer group."""
+
+    @abc.abstractmethod
+    def _commit(self, consumer, offsets):
+        """Commit {partition: offset of the next message to consume} for a consumer."""
+
+    @property
+    def producer(self):
+        """The producer, opened on first use."""
+        with self._connection_lock:
+            if self._producer is None:
+                self._producer = self._create_producer()
+            return self._producer
+
+    @property
+    def consumer(self):
+        """The consumer of the article topic, opened (and joined to its group) on first use."""
+        with self._connection_lock:
+            if self._consumer is None:
+                self._consumer = self._create_consumer(self.topic, self.group_id)
+            return self._consumer
+
+    @property
+    def processed_consumer(self):
+        """The consumer of the processed topic, opened (and joined to its group) on first use."""
+        with self._connection_lock:
+            if self._processed_consumer is None:
+                self._processed_consumer = self._create_consumer(self.processed_topic, self.processed_group_id)
+            return self._processed_consumer
+
+    def _on_delivery(self, record_metadata):
+        with self._metrics_lock:
+            self.delivery_metrics["delivered"] += 1
+            self.delivery_metrics["bytes"] += max(record_metadata.serialized_value_size, 0)
+        logging.debug(f"Delivered message to {record_metadata.topic}[{record_metadata.partition}] at offset {record_metadata.offset}")
+
+    def _on_delivery_error(self, exception):
+        with self._metrics_lock:
+            self.delivery_metrics["failed"] += 1
+        logging.error(f"Failed to deliver message: {exception}")
+
+    @staticmethod
+    def article_key(article):
+        """Return a stable message key for an article, the hash of its URL.
+        Kafka routes all messages with the same key to the same partition."""
+        return hashlib.sha1(article['url'].encode('utf-8')).hexdigest()
+
+    def _send(self, topic, message, key=None):
+        """Send a message asynchronously and track its delivery through callbacks."""
+        future = self.producer.send(topic, message, key=key)
+        future.add_callback(self._on_delivery)
+        future.add_errback(self._on_delivery_error)
+        with self._metrics_lock:
+            self.delivery_metrics["sent"] += 1
+        if self.flush_each_message:
+            self.producer.flush()
+        return future
+
+    def flush(self, timeout=None):
+        """Checkpoint: block until all buffered messages are delivered (or failed)."""
+        if self._producer is None:
+            return
+        start_time = time.time()
+        self._producer.flush(timeout=timeout)
+        logging.info(f"Flushed producer in {time.time() - start_time:.3f} seconds, delivery metrics: {self.get_delivery_metrics()}")
+
+    def get_delivery_metrics(self):
+        """Return the counts of sent, delivered and failed messages and the delivered bytes."""
+        with self._metrics_lock:
+            metrics = dict(self.delivery_metrics)
+        metrics["pending"] = metrics["sent"] - metrics["delivered"] - metrics["failed"]
+        return metrics
+
+    def enqueue(self, message):
+       try:
+           self._send(self.topic, message)
+           logging.debug(f"Enqueued message to {self.topic}")
+       except Exception as e:
+           logging.error(f"Failed to enqueue message: {e}")
+
+    def enqueue_articles(self, articles):
+        """Enqueue every article as its own message, keyed by the hash of its URL, so that articles
+        spread over the partitions and can be consumed by several workers in parallel."""
+        enqueued = 0
+        for article in articles:
+            try:
+                self._send(self.topic, article, key=self.article_key(article))
+                enqueued += 1
+            except Exception as e:
+                logging.error(f"Failed to enqueue article {article.get('url', 'N/A')}: {e}")
+        logging.info(f"Enqueued {enqueued} of {len(articles)} articles to {self.topic}")
+        return enqueued
+
+    def dequeue(self):
+        for message in self.consumer:
+            logging.info(f"Dequeued message: {message.value}")
+            yield message.value
+
+    def _poll_batch(self, consumer, max_records, max_wait_ms):
+        """Poll until max_records messages arrived or max_wait_ms passed, whichever comes first.
+        Returns the message values and, per partition, the offset of the next message to consume."""
+        batch = []
+        offsets = {}
+        deadline = time.monotonic() + max_wait_ms / 1000
+        while len(batch) < max_records:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            records = consumer.poll(timeout_ms=remaining_ms, max_records=max_records - len(batch))
+            for partition, partition_records in records.items():
+                batch.extend(record.value for record in partition_records)
+                offsets[partition] = partition_records[-1].offset + 1
+        return batch, offsets
+
+    def dequeue_batch(self, max_records=KAFKA_CONSUMER_SETTINGS["max_records"], max_wait_ms=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], with_offsets=False):
+        """Return up to max_records messages, waiting at most max_wait_ms; the batch may be empty.
+        With with_offsets=True a (messages, offsets) tuple is returned, for mark_processed()."""
+        batch, offsets = self._poll_batch(self.consumer, max_records, max_wait_ms)
+        if batch:
+            logging.info(f"Dequeued batch of {len(batch)} messages")
+        return (batch, offsets) if with_offsets else batch
+
+    def consume_batches(self, max_records=KAFKA_CONSUMER_SETTINGS["max_records"], max_wait_ms=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], with_offsets=False):
+        """Yield non-empty batches of messages for as long as the consumer runs.
+        In manual commit mode, due commits of processed offsets happen between the polls."""
+        while True:
+            self.commit_processed()
+            batch, offsets = self._poll_batch(self.consumer, max_records, max_wait_ms)
+            if batch:
+                logging.info(f"Dequeued batch of {len(batch)} messages")
+                yield (batch, offsets) if with_offsets else batch
+
+    def pause(self):
+        """Stop fetching from the assigned partitions of the article topic, e.g. while the processing
+        side is saturated. The consumer stays in its group as long as poll_paused() is called."""
+        self.consumer.pause(*self.consumer.assignment())
+
+    def resume(self):
+        """Resume fetching from the paused partitions of the article topic."""
+        self.consumer.resume(*self.consumer.paused())
+
+    def poll_paused(self, timeout_ms):
+        """Poll while paused, so that the consumer keeps its group membership. Partitions assigned by a
+        rebalance in the meantime are paused as well, and records fetched from them before that are
+        rewound, so that they are delivered again after resume()."""
+        self.pause()
+        records = self.consumer.poll(timeout_ms=timeout_ms)
+        for partition, partition_records in records.items():
+            self.consumer.seek(partition, partition_records[0].offset)
+
+    def mark_processed(self, offsets):
+        """Mark a batch as processed, so that its offsets are included in the next commit.
+        Thread-safe: may be called from the processing thread while the consumer thread polls."""
+        with self._commit_lock:
+            for partition, offset in offsets.items():
+                self._marked_offsets[partition] = max(offset, self._marked_offsets.get(partition, 0))
+            self._marked_batches += 1
+
+    def commit_processed(self, force=False):
+        """Commit the marked offsets if enough batches or time accumulated, or always with force=True.
+        Must be called from the thread that polls the consumers, as consumers are not thread-safe."""
+        if not self.manual_commit:
+            return
+        with self._commit_lock:
+            due = (self._marked_batches >= KAFKA_CONSUMER_SETTINGS["commit_every_batches"]
+                   or time.monotonic() - self._last_commit >= KAFKA_CONSUMER_SETTINGS["commit_interval_ms"] / 1000)
+            if not self._marked_offsets or not (force or due):
+                return
+            marked_offsets, self._marked_offsets = self._marked_offsets, {}
+            self._marked_batches = 0
+            self._last_commit = time.monotonic()
+
+        for consumer, topic in ((self._consumer, self.topic), (self._processed_consumer, self.processed_topic)):
+            if consumer is None:
+                continue
+            offsets = {partition: offset for partition, offset in marked_offsets.items() if partition.topic == topic}
+            if offsets:
+                self._commit(consumer, offsets)
+
+    def enqueue_processed(self, message, key=None):
+        future = self._send(self.processed_topic, message, key=key)
+        logging.debug(f"Enqueued processed message to {self.processed_topic}")
+        return future
+
+    def dequeue_processed(self):
+        for message in self.processed_consumer:
+            logging.info(f"Dequeued processed message: {message.value}")
+            yield message.value
+
+    def dequeue_processed_batch(self, max_records=KAFKA_CONSUMER_SETTINGS["max_records"], max_wait_ms=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], with_offsets=False):
+        """Return up to max_records processed messages, waiting at most max_wait_ms; the batch may be empty.
+        With with_offsets=True a (messages, offsets) tuple is returned, for mark_processed()."""
+        self.commit_processed()
+        batch, offsets = self._poll_batch(self.processed_consumer, max_records, max_wait_ms)
+        if batch:
+            logging.info(f"Dequeued batch of {len(batch)} processed messages")
+        return (batch, offsets) if with_offsets else batch
+
+    def close(self):
+        """Close the connections that were opened; closing the producer flushes whatever is still buffered."""
+        if self._producer is not None:
+            self._producer.close()
+            logging.info(f"Closed producer, delivery metrics: {self.get_delivery_metrics()}")
+        self.commit_processed(force=True)
+        for consumer in (self._consumer, self._processed_consumer):
+            if consumer is not None:
+                consumer.close()
+        self._producer = self._consumer = self._processed_consumer = None
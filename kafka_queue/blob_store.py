@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import zlib
+
+from config import CLAIM_CHECK_SETTINGS
+
+TEXT_FIELDS = ("main_text", "lead_text")
+REF_SUFFIX = "_ref"
+
+class BlobStore:
+    """Content-addressed store for article texts, for the claim-check pattern: the texts are written
+    here and only their references travel through the queue.
+
+    A blob is the zlib-compressed UTF-8 text, stored under the SHA-256 of the text, so writing the same
+    text twice is a no-op and concurrent writers never conflict. The store directory may be shared
+    between machines (e.g. NFS); with a cache directory, blobs read from it are kept locally, and the
+    least recently used ones are evicted once the cache exceeds cache_max_bytes.
+    """
+
+    def __init__(self, path=CLAIM_CHECK_SETTINGS["store_path"], cache_path=CLAIM_CHECK_SETTINGS["cache_path"],
+                 cache_max_bytes=CLAIM_CHECK_SETTINGS["cache_max_bytes"]):
+        self.path = path
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self._cache_lock = threading.Lock()
+        self._cache_bytes = None
+        self.metrics = {"puts": 0, "gets": 0, "cache_hits": 0, "bytes_written": 0}
+        os.makedirs(path, exist_ok=True)
+        if cache_path:
+            os.makedirs(cache_path, exist_ok=True)
+
+    @staticmethod
+    def _relative_path(digest):
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+    def put(self, text):
+        """Store a text and return its reference."""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.path, self._relative_path(digest))
+        self.metrics["puts"] += 1
+        if not os.path.exists(path):
+            compressed = zlib.compress(data)
+            self._write_atomic(path, compressed)
+            self.metrics["bytes_written"] += len(compressed)
+        return f"sha256:{digest}"
+
+    def get(self, ref):
+        """Return the text of a reference, from the local cache if possible."""
+        algorithm, digest = ref.split(":", 1)
+        if algorithm != "sha256":
+            raise ValueError(f"Unsupported blob reference: {ref}")
+        relative_path = self._relative_path(digest)
+        self.metrics["gets"] += 1
+        if self.cache_path:
+            cache_file = os.path.join(self.cache_path, relative_path)
+            try:
+                with open(cache_file, "rb") as f:
+                    compressed = f.read()
+                os.utime(cache_file)  # Marks the blob as recently used
+                self.metrics["cache_hits"] += 1
+                return zlib.decompress(compressed).decode("utf-8")
+            except FileNotFoundError:
+                pass
+        with open(os.path.join(self.path, relative_path), "rb") as f:
+            compressed = f.read()
+        if self.cache_path:
+            self._write_atomic(cache_file, compressed)
+            self._account_cache(len(compressed))
+        return zlib.decompress(compressed).decode("utf-8")
+
+    def _account_cache(self, size):
+        with self._cache_lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(entry[1] for entry in self._cache_entries())
+            else:
+                self._cache_bytes += size
+            if self._cache_bytes > self.cache_max_bytes:
+                self._evict()
+
+    def _cache_entries(self):
+        for directory, _, files in os.walk(self.cache_path):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Evict the least recently used blobs until the cache is below 80% of its limit."""
+        entries = sorted(self._cache_entries(), key=lambda entry: entry[2])
+        self._cache_bytes = sum(entry[1] for entry in entries)
+        target = self.cache_max_bytes * 0.8
+        evicted = 0
+        for path, size, _ in entries:
+            if self._cache_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._cache_bytes -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} blobs from the cache in {self.cache_path}")
+
+    def clear_cache(self):
+        if self.cache_path:
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+            os.makedirs(self.cache_path, exist_ok=True)
+            self._cache_bytes = 0
+
+
+def check_in(articles, blob_store, fields=TEXT_FIELDS):
+    """Move the texts of articles into the blob store, replacing each field by a <field>_ref reference."""
+    for article in articles:
+        for field in fields:
+            if article.get(field) is not None:
+                article[field + REF_SUFFIX] = blob_store.put(article.pop(field))
+    return articles
+
+def check_out(articles, blob_store, fields=TEXT_FIELDS):
+    """Fetch the referenced texts of articles back into their fields. Articles that still carry the
+    texts themselves, e.g. enqueued before claim checks were enabled, are left as they are."""
+    for article in articles:
+        for field in fields:
+            ref = article.get(field + REF_SUFFIX)
+            if ref is not None and field not in article:
+                article[field] = blob_store.get(ref)
+    return articles
+
+def without_texts(article, fields=TEXT_FIELDS):
+    """Return a copy of an article without its texts and text references."""
+    excluded = set(fields) | {field + REF_SUFFIX for field in fields}
+    return {k: v for k, v in article.items() if k not in excluded}
@@ -0,0 +1,74 @@
+import logging
+import queue
+import threading
+import time
+
+class BoundedHandOff:
+    """A bounded queue between the consuming thread and the processing thread that measures the time
+    both sides wait. Long put waits mean the models are the bottleneck and the buffer is full; long get
+    waits mean the models idle for input and a larger buffer or batch could help."""
+
+    def __init__(self, max_batches):
+        self.max_batches = max_batches
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._lock = threading.Lock()
+        self._metrics = {"batches": 0, "max_depth": 0, "put_wait_seconds": 0.0, "get_wait_seconds": 0.0,
+                         "pauses": 0, "paused_seconds": 0.0}
+
+    def put(self, item, timeout=None):
+        """Put an item, waiting at most timeout seconds for space. Returns False if the buffer stayed full."""
+        start = time.monotonic()
+        try:
+            self._queue.put(item, block=timeout != 0, timeout=timeout or None)
+        except queue.Full:
+            return False
+        finally:
+            self._add("put_wait_seconds", time.monotonic() - start)
+        with self._lock:
+            self._metrics["batches"] += 1
+            self._metrics["max_depth"] = max(self._metrics["max_depth"], self._queue.qsize())
+        return True
+
+    def put_termination(self, consumer_alive):
+        """Put the termination signal, waiting for space as long as consumer_alive() is true;
+        a consumer that already stopped takes nothing out of a full buffer anymore."""
+        while consumer_alive():
+            try:
+                self._queue.put(None, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self):
+        start = time.monotonic()
+        item = self._queue.get()
+        self._add("get_wait_seconds", time.monotonic() - start)
+        return item
+
+    def record_pause(self, seconds):
+        with self._lock:
+            self._metrics["pauses"] += 1
+            self._metrics["paused_seconds"] += seconds
+
+    def _add(self, name, seconds):
+        with self._lock:
+            self._metrics[name] += seconds
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return the current depth and the counters since the start."""
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["depth"] = self.depth()
+        stats["max_batches"] = self.max_batches
+        if stats["batches"]:
+            stats["avg_get_wait_seconds"] = stats["get_wait_seconds"] / stats["batches"]
+        for name, value in stats.items():
+            if isinstance(value, float):
+                stats[name] = round(value, 3)
+        return stats
+
+    def log_stats(self):
+        logging.info(f"Hand-off buffer: {self.stats()}")
@@ -1,56 +1,63 @@
 from kafka import KafkaProducer, KafkaConsumer
-import json
+from kafka.structs import OffsetAndMetadata
+from kafka.errors import CommitFailedError
 import logging
+from kafka_queue.base_queue import BaseQueue
+from kafka_queue import wire_format
+from config import KAFKA_CONSUMER_SETTINGS, KAFKA_PRODUCER_SETTINGS, WIRE_FORMAT
 
-class KafkaQueue:
-    def __init__(self, topic='raw_articles', processed_topic='processed_article_queue', bootstrap_servers='localhost:9092'):
-        self.topic = topic
-        self.processed_topic = processed_topic
-        self.producer = KafkaProducer(
-            bootstrap_servers=bootstrap_servers,
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
-        )
-        self.consumer = KafkaConsumer(
-            self.topic,
-            bootstrap_servers=bootstrap_servers,
-            value_deserializer=lambda x: json.loads(x.decode('utf-8')),
-            auto_offset_reset='earliest',
-            enable_auto_commit=True,
-            group_id='article_group'
-        )
-        self.processed_consumer = KafkaConsumer(
-            self.processed_topic,
-            bootstrap_servers=bootstrap_servers,
-            value_deserializer=lambda x: json.loads(x.decode('utf-8')),
-            auto_offset_reset='earliest',
-            enable_auto_commit=True,
-            group_id='processed_article_group'
-        )
+class KafkaQueue(BaseQueue):
+    def __init__(self, topic='raw_articles', processed_topic='processed_article_queue', bootstrap_servers='localhost:9092', flush_each_message=False, manual_commit=False,
+                 group_id='article_group', processed_group_id='processed_article_group'):
+        """Initialize the queue. By default the producer batches and compresses messages in the background
+        (see KAFKA_PRODUCER_SETTINGS) and only flushes on flush() or close(); with flush_each_message=True
+        every send waits for the broker, as before.
 
-    def enqueue(self, message):
-       try:
-           self.producer.send(self.topic, message)
-           self.producer.flush()
-           logging.info(f"Enqueued message: {message}")
-       except Exception as e:
-           logging.error(f"Failed to enqueue message: {e}")
+        With manual_commit=True offsets are not committed automatically: the caller marks batches as
+        processed with mark_processed() once their results are safely forwarded, and the marked offsets
+        are committed in batches (see KAFKA_CONSUMER_SETTINGS), which gives at-least-once delivery.
 
-    def dequeue(self):
-        for message in self.consumer:
-            logging.info(f"Dequeued message: {message.value}")
-            yield message.value
+        The consumer group ids can be overridden, e.g. to let several pipeline stages read the same topic."""
+        super().__init__(topic, processed_topic, flush_each_message, manual_commit, group_id, processed_group_id)
+        self.bootstrap_servers = bootstrap_servers
 
-    def enqueue_processed(self, message):
-        self.producer.send(self.processed_topic, message)
-        self.producer.flush()
-        logging.info(f"Enqueued processed message: {message}")
+    def _create_consumer(self, topic, group_id):
+        logging.info(f"Opening Kafka consumer for {topic} in group {group_id}")
+        return KafkaConsumer(
+            topic,
+            bootstrap_servers=self.bootstrap_servers,
+            value_deserializer=wire_format.decode,
+            auto_offset_reset='earliest',
+            enable_auto_commit=not self.manual_commit,
+            group_id=group_id,
+            max_poll_records=KAFKA_CONSUMER_SETTINGS["max_records"]
+        )
+
+    def _create_producer(self):
+        logging.info("Opening Kafka producer")
+        return KafkaProducer(
+            bootstrap_servers=self.bootstrap_servers,
+            value_serializer=lambda v: wire_format.encode(v, WIRE_FORMAT),
+            key_serializer=lambda k: k.encode('utf-8') if k is not None else None,
+            linger_ms=KAFKA_PRODUCER_SETTINGS["linger_ms"],
+            batch_size=KAFKA_PRODUCER_SETTINGS["batch_size"],
+            compression_type=KAFKA_PRODUCER_SETTINGS["compression_type"],
+            acks=KAFKA_PRODUCER_SETTINGS["acks"]
+        )
 
-    def dequeue_processed(self):
-        for message in self.processed_consumer:
-            logging.info(f"Dequeued processed message: {message.value}")
-            yield message.value
+    @staticmethod
+    def _offset_and_metadata(offset):
+        # kafka-python >= 2.1 added a leader_epoch field to OffsetAndMetadata
+        try:
+            return OffsetAndMetadata(offset, '')
+        except TypeError:
+            return OffsetAndMetadata(offset, '', -1)
 
-    def close(self):
-        self.producer.close()
-        self.consumer.close()
-        self.processed_consumer.close()
+    def _commit(self, consumer, offsets):
+        offsets = {partition: self._offset_and_metadata(offset) for partition, offset in offsets.items()}
+        try:
+            consumer.commit(offsets)
+            logging.debug(f"Committed offsets {offsets}")
+        except CommitFailedError as e:
+            # The partitions were reassigned in a rebalance; their messages will be redelivered
+            logging.warning(f"Failed to commit offsets after a rebalance, messages will be redelivered: {e}")
@@ -0,0 +1,300 @@
+import fcntl
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from kafka_queue.base_queue import BaseQueue
+from kafka_queue.wire_format import json_default
+from config import LOCAL_QUEUE_SETTINGS
+
+# Same shapes as the kafka-python structs, so that BaseQueue handles both backends alike
+TopicPartition = namedtuple("TopicPartition", ["topic", "partition"])
+ConsumerRecord = namedtuple("ConsumerRecord", ["topic", "partition", "offset", "timestamp", "key", "value"])
+RecordMetadata = namedtuple("RecordMetadata", ["topic", "partition", "offset", "serialized_value_size"])
+
+class LocalFuture:
+    """An already resolved send result, with the parts of the kafka-python future API the queue uses."""
+
+    def __init__(self, value=None, exception=None):
+        self.value = value
+        self.exception = exception
+        self.is_done = True
+
+    def succeeded(self):
+        return self.exception is None
+
+    def failed(self):
+        return self.exception is not None
+
+    def get(self, timeout=None):
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def add_callback(self, f, *args, **kwargs):
+        if self.succeeded():
+            f(*args, self.value, **kwargs)
+        return self
+
+    def add_errback(self, f, *args, **kwargs):
+        if self.failed():
+            f(*args, self.exception, **kwargs)
+        return self
+
+
+class LocalLog:
+    """An append-only log of one topic on disk. It is split into JSON lines segments, each named by the
+    offset of its first record, and a new segment starts once the active one exceeds segment_bytes.
+    Appends from several processes are serialized with a file lock. A log has a single partition 0."""
+
+    def __init__(self, directory, topic, segment_bytes=LOCAL_QUEUE_SETTINGS["segment_bytes"]):
+        self.topic = topic
+        self.path = os.path.join(directory, topic)
+        self.segment_bytes = segment_bytes
+        os.makedirs(os.path.join(self.path, "offsets"), exist_ok=True)
+        self._lock_path = os.path.join(self.path, ".lock")
+
+    def segments(self):
+        """Return the base offsets of the segments in ascending order."""
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+
+    def segment_path(self, base_offset):
+        return os.path.join(self.path, f"{base_offset:020d}.log")
+
+    def _next_offset(self, base_offset):
+        """Return the offset after the last complete record of a segment. A torn last record,
+        left by a crash in the middle of an append, is cut off."""
+        path = self.segment_path(base_offset)
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            position, tail = end, b""
+            # Read backwards until the start of the last complete line
+            while position > 0 and tail.count(b"\n") < 2:
+                step = min(64 * 1024, position)
+                position -= step
+                f.seek(position)
+                tail = f.read(step) + tail
+            if tail and not tail.endswith(b"\n"):
+                logging.warning(f"Cutting off a torn record at the end of {path}")
+                cut = tail.rfind(b"\n") + 1
+                f.truncate(position + cut)
+                tail = tail[:cut]
+        lines = tail.splitlines()
+        if not lines:
+            return base_offset
+        return json.loads(lines[-1])["offset"] + 1
+
+    def append(self, records):
+        """Append (key, value) records and return their offsets and serialized sizes."""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            segments = self.segments()
+            next_offset = self._next_offset(segments[-1]) if segments else 0
+            if not segments or os.path.getsize(self.segment_path(segments[-1])) >= self.segment_bytes:
+                segments.append(next_offset)
+            lines, metadata = [], []
+            for key, value in records:
+                line = json.dumps({"offset": next_offset, "timestamp": int(time.time() * 1000), "key": key, "value": value}, default=json_default) + "\n"
+                lines.append(line)
+                metadata.append((next_offset, len(line)))
+                next_offset += 1
+            with open(self.segment_path(segments[-1]), "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        return metadata
+
+    def committed(self, group_id):
+        """Return the committed offset of a consumer group, 0 if it never committed."""
+        try:
+            with open(os.path.join(self.path, "offsets", f"{group_id}.json")) as f:
+                return json.load(f)["offset"]
+        except FileNotFoundError:
+            return 0
+
+    def commit(self, group_id, offset):
+        path = os.path.join(self.path, "offsets", f"{group_id}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def delete_consumed_segments(self):
+        """Delete the segments that every consumer group has consumed completely."""
+        groups = [name[:-5] for name in os.listdir(os.path.join(self.path, "offsets")) if name.endswith(".json")]
+        if not groups:
+            return 0
+        consumed = min(self.committed(group_id) for group_id in groups)
+        segments = self.segments()
+        deleted = 0
+        # A segment is consumed completely when the next segment starts at or below the consumed offset
+        for base_offset, next_base_offset in zip(segments, segments[1:]):
+            if next_base_offset <= consumed:
+                os.remove(self.segment_path(base_offset))
+                deleted += 1
+        logging.info(f"Deleted {deleted} consumed segments of {self.topic}")
+        return deleted
+
+
+class LocalLogProducer:
+    """Appends messages to the local logs; every send is written before it returns."""
+
+    def __init__(self, directory, segment_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._logs = {}
+
+    def send(self, topic, value, key=None):
+        if topic not in self._logs:
+            self._logs[topic] = LocalLog(self.directory, topic, self.segment_bytes)
+        try:
+            [(offset, size)] = self._logs[topic].append([(key, value)])
+        except (OSError, TypeError, ValueError) as e:
+            return LocalFuture(exception=e)
+        return LocalFuture(RecordMetadata(topic, 0, offset, size))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalLogConsumer:
+    """Reads a local log from the committed offset of its consumer group. The log has a single partition,
+    so only one consumer per group reads at a time: further consumers of the group wait for its lock,
+    like surplus Kafka consumers stay idle without a partition."""
+
+    def __init__(self, log, group_id, auto_commit, poll_interval_ms=LOCAL_QUEUE_SETTINGS["poll_interval_ms"]):
+        self.log = log
+        self.group_id = group_id
+        self.auto_commit = auto_commit
+        self.poll_interval = poll_interval_ms / 1000
+        self.partition = TopicPartition(log.topic, 0)
+        self._group_lock = open(os.path.join(log.path, "offsets", f"{group_id}.lock"), "a")
+        try:
+            fcntl.flock(self._group_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info(f"Another consumer of group {group_id} reads {log.topic}, waiting for it to stop")
+            fcntl.flock(self._group_lock, fcntl.LOCK_EX)
+        self._position = log.committed(group_id)
+        self._segment = None
+        self._file = None
+        self._paused = False
+
+    def _open_segment(self):
+        """Open the segment that holds the current position, or None if there is none yet."""
+        segments = [base_offset for base_offset in self.log.segments() if base_offset <= self._position]
+        if not segments:
+            segments = self.log.segments()[:1]
+            if not segments:
+                return False
+        if self._file is not None:
+            self._file.close()
+        self._segment = segments[-1]
+        self._file = open(self.log.segment_path(self._segment), "r", encoding="utf-8")
+        return True
+
+    def _read(self, max_records):
+        if self._file is None and not self._open_segment():
+            return []
+        records = []
+        while len(records) < max_records:
+            start = self._file.tell()
+            line = self._file.readline()
+            if not line.endswith("\n"):
+                # End of the segment, or a record that is still being written
+                self._file.seek(start)
+                later_segments = [base_offset for base_offset in self.log.segments() if base_offset > self._segment]
+                if line or not later_segments:
+                    break
+                self._open_segment_at(later_segments[0])
+                continue
+            record = json.loads(line)
+            if record["offset"] < self._position:
+                continue
+            records.append(ConsumerRecord(self.log.topic, 0, record["offset"], record["timestamp"], record["key"], record["value"]))
+            self._position = record["offset"] + 1
+        return records
+
+    def _open_segment_at(self, base_offset):
+        self._file.close()
+        self._segment = base_offset
+        self._file = open(self.log.segment_path(base_offset), "r", encoding="utf-8")
+
+    def poll(self, timeout_ms=0, max_records=None):
+        """Return {partition: records} with up to max_records new records, waiting at most timeout_ms."""
+        max_records = max_records or LOCAL_QUEUE_SETTINGS["max_poll_records"]
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            records = [] if self._paused else self._read(max_records)
+            if records:
+                if self.auto_commit:
+                    self.commit({self.partition: self._position})
+                return {self.partition: records}
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {}
+            time.sleep(min(self.poll_interval, remaining))
+
+    def assignment(self):
+        return {self.partition}
+
+    def pause(self, *partitions):
+        if self.partition in partitions:
+            self._paused = True
+
+    def resume(self, *partitions):
+        if self.partition in partitions:
+            self._paused = False
+
+    def paused(self):
+        return {self.partition} if self._paused else set()
+
+    def seek(self, partition, offset):
+        """Continue reading at offset; the segment holding it is looked up on the next read."""
+        self._position = offset
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __iter__(self):
+        while True:
+            for records in self.poll(timeout_ms=1000).values():
+                yield from records
+
+    def commit(self, offsets=None):
+        offset = offsets[self.partition] if offsets else self._position
+        self.log.commit(self.group_id, offset)
+        logging.debug(f"Committed offset {offset} of {self.log.topic} for group {self.group_id}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._group_lock.close()  # Releases the group lock
+
+
+class LocalQueue(BaseQueue):
+    def __init__(self, topic='raw_articles', processed_topic='processed_article_queue', directory=LOCAL_QUEUE_SETTINGS["directory"], flush_each_message=False, manual_commit=False,
+                 group_id='article_group', processed_group_id='processed_article_group'):
+        """A broker-free queue on an append-only log per topic under directory, for single-node runs,
+        tests and benchmarks. Enqueue, micro-batch consumption and manual commits behave like KafkaQueue,
+        except that a topic has a single partition, so a consumer group has one active consumer."""
+        super().__init__(topic, processed_topic, flush_each_message, manual_commit, group_id, processed_group_id)
+        self.directory = directory
+
+    def _create_producer(self):
+        logging.info(f"Opening local log producer in {self.directory}")
+        return LocalLogProducer(self.directory, LOCAL_QUEUE_SETTINGS["segment_bytes"])
+
+    def _create_consumer(self, topic, group_id):
+        logging.info(f"Opening local log consumer for {topic} in group {group_id}")
+        return LocalLogConsumer(LocalLog(self.directory, topic, LOCAL_QUEUE_SETTINGS["segment_bytes"]), group_id,
+                                auto_commit=not self.manual_commit)
+
+    def _commit(self, consumer, offsets):
+        consumer.commit(offsets)
+
+    def delete_consumed_segments(self):
+        """Reclaim disk space: delete the segments of both topics that all consumer groups consumed."""
+        return sum(LocalLog(self.directory, topic).delete_consumed_segments() for topic in (self.topic, self.processed_topic))
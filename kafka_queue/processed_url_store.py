@@ -0,0 +1,106 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from kafka_queue.blob_store import TEXT_FIELDS, REF_SUFFIX
+from config import PROCESSED_URL_STORE_SETTINGS
+
+# Fields that change on every scrape without the article changing
+VOLATILE_FIELDS = {"last_online_verification_date"}
+
+def content_hash(article):
+    """Hash of the scraped content of an article. The texts enter as their blob references, so an article
+    hashes the same whether its texts travel inline or as claim checks."""
+    content = {field: value for field, value in article.items() if field not in VOLATILE_FIELDS and field not in TEXT_FIELDS}
+    for field in TEXT_FIELDS:
+        if article.get(field) is not None:
+            content[field + REF_SUFFIX] = f"sha256:{hashlib.sha256(article[field].encode('utf-8')).hexdigest()}"
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+class ProcessedUrlStore:
+    """Remembers which versions of articles had their processing results forwarded.
+
+    With at-least-once delivery a crash between forwarding results and committing offsets leads to
+    redelivered articles; checking them here lets the worker skip them before any model runs. An entry
+    is the URL together with the hash of the scraped content, so a re-scrape with changed content is
+    processed again. Redeliveries only happen within the retention of the topic, so entries older than
+    retention_days are dropped. The store is an SQLite file, so all worker processes on a machine share
+    it, with an in-memory LRU set of at most memory_entries entries in front.
+    """
+
+    def __init__(self, path=PROCESSED_URL_STORE_SETTINGS["path"], retention_days=PROCESSED_URL_STORE_SETTINGS["retention_days"],
+                 memory_entries=PROCESSED_URL_STORE_SETTINGS["memory_entries"]):
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        self.memory_entries = memory_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._known = collections.OrderedDict()
+        self._last_prune = 0.0
+        # The timeout lets concurrent writers of other worker processes wait for the file lock
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS processed_articles (
+            url TEXT, content_hash TEXT, processed_at REAL, PRIMARY KEY (url, content_hash))""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS processed_articles_processed_at ON processed_articles (processed_at)")
+        self._connection.commit()
+
+    def _remember(self, keys):
+        for key in keys:
+            self._known[key] = True
+            self._known.move_to_end(key)
+        while len(self._known) > self.memory_entries:
+            self._known.popitem(last=False)
+
+    def _is_known(self, key):
+        if key in self._known:
+            self._known.move_to_end(key)
+            return True
+        return False
+
+    @staticmethod
+    def key(article):
+        """The entry of an article as scraped, i.e. before any analysis fields were added."""
+        return article['url'], content_hash(article)
+
+    def filter_unprocessed(self, articles):
+        """Return the articles whose current content has not been processed yet."""
+        keys = [self.key(article) for article in articles]
+        with self._lock:
+            processed = {key for key in keys if self._is_known(key)}
+            unknown = [key for key in keys if key not in processed]
+            for i in range(0, len(unknown), 400):
+                chunk = unknown[i:i + 400]
+                rows = self._connection.execute(
+                    f"SELECT url, content_hash FROM processed_articles WHERE (url, content_hash) IN "
+                    f"(VALUES {', '.join(['(?, ?)'] * len(chunk))})", [value for key in chunk for value in key]).fetchall()
+                processed.update(tuple(row) for row in rows)
+            self._remember(processed)
+        unprocessed = [article for article, key in zip(articles, keys) if key not in processed]
+        if len(unprocessed) < len(articles):
+            logging.info(f"Skipping {len(articles) - len(unprocessed)} already processed articles")
+        return unprocessed
+
+    def mark(self, keys):
+        """Record entries, as returned by key(), as processed."""
+        keys = list(keys)
+        now = time.time()
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO processed_articles (url, content_hash, processed_at) VALUES (?, ?, ?)",
+                                         [(url, digest, now) for url, digest in keys])
+            if now - self._last_prune >= 60 * 60:
+                deleted = self._connection.execute("DELETE FROM processed_articles WHERE processed_at < ?",
+                                                   (now - self.retention_seconds,)).rowcount
+                self._last_prune = now
+                if deleted:
+                    logging.info(f"Dropped {deleted} processed article entries older than the retention")
+            self._connection.commit()
+            self._remember(keys)
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,12 @@
+from config import QUEUE_BACKEND
+
+def create_queue(backend=QUEUE_BACKEND, **kwargs):
+    """Create the queue of the configured backend, "kafka" or "local". The backends are imported
+    lazily, so the local backend works without kafka-python installed."""
+    if backend == "kafka":
+        from kafka_queue.kafka_manager import KafkaQueue
+        return KafkaQueue(**kwargs)
+    if backend == "local":
+        from kafka_queue.local_queue import LocalQueue
+        return LocalQueue(**kwargs)
+    raise ValueError(f"Unknown queue backend: {backend}")
@@ -0,0 +1,62 @@
+import json
+
+import msgpack
+import numpy as np
+
+from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION
+
+# Binary records start with a marker byte that neither JSON nor msgpack ever produce (0xc1 is unused
+# in msgpack and not valid JSON), followed by "M3" and the format version, so that decode() tells
+# them apart from legacy JSON messages
+MARKER = b"\xc1M3"
+VERSION = 1
+FLOAT32_ARRAY_EXT = 1
+# Only the embedding fields of the Vectorizer are packed as raw float32 arrays, they are float32 already;
+# every other float keeps its full precision
+EMBEDDING_FIELDS = frozenset(f"{prefix}_{key}" for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION for prefix in ("lead", "full"))
+
+def _pack_vectors(value):
+    """Replace the embedding fields in a record by float32 numpy arrays, recursively, so that stage
+    results and lists of articles are covered as well."""
+    if isinstance(value, dict):
+        return {k: np.asarray(v, dtype=np.float32) if k in EMBEDDING_FIELDS and isinstance(v, list) and v
+                else _pack_vectors(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_pack_vectors(v) for v in value]
+    return value
+
+def _default(value):
+    if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind == "f":
+        return msgpack.ExtType(FLOAT32_ARRAY_EXT, value.astype("<f4", copy=False).tobytes())
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+def _ext_hook(code, data):
+    if code == FLOAT32_ARRAY_EXT:
+        # A read-only view on the message buffer, no copy; JSON writers pass default=json_default
+        return np.frombuffer(data, dtype="<f4")
+    return msgpack.ExtType(code, data)
+
+def json_default(value):
+    """json.dumps default for records decoded from the binary format: arrays become lists."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode(record, wire_format="msgpack"):
+    """Serialize a record, as versioned msgpack with float32 arrays or as legacy JSON."""
+    if wire_format == "json":
+        return json.dumps(record, default=json_default).encode("utf-8")
+    return MARKER + bytes([VERSION]) + msgpack.packb(_pack_vectors(record), default=_default, use_bin_type=True)
+
+def decode(data):
+    """Deserialize a record of either format. Embeddings of binary records are read-only float32 numpy views."""
+    if not data.startswith(MARKER):
+        return json.loads(data.decode("utf-8"))
+    version = data[len(MARKER)]
+    if version != VERSION:
+        raise ValueError(f"Unsupported record format version {version}")
+    return msgpack.unpackb(memoryview(data)[len(MARKER) + 1:], ext_hook=_ext_hook, raw=False, strict_map_key=False)
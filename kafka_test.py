@@ -1,13 +1,15 @@
 # kafka_test.py
+import argparse
 import logging
-from kafka_queue.kafka_manager import KafkaQueue
+from kafka_queue.queue_factory import create_queue
+from config import QUEUE_BACKEND
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-def main():
-    # Create an instance of KafkaQueue
-    kafka_queue = KafkaQueue(topic='test-topic')
+def main(backend):
+    # Create the queue; with the local backend no broker is needed
+    kafka_queue = create_queue(backend, topic='test-topic')
 
     # Sending messages to the 'article_queue'
     messages_to_send = [
@@ -18,23 +20,28 @@ def main():
 
     for message in messages_to_send:
         kafka_queue.enqueue(message)
+    kafka_queue.flush()
 
     # Receiving messages from the 'article_queue'
     logging.info("Receiving messages from the test topic:")
-    for message in kafka_queue.dequeue():  # This will now consume from 'test-topic'
+    for message in kafka_queue.dequeue_batch(max_records=len(messages_to_send), max_wait_ms=10000):
         logging.info(f"Received message: {message}")
 
     # Optionally, send processed messages to the 'processed_article_queue'
     for message in messages_to_send:
         kafka_queue.enqueue_processed(message)
+    kafka_queue.flush()
 
     # Receiving processed messages
     logging.info("Receiving messages from the processed_article_queue:")
-    for message in kafka_queue.dequeue_processed():
+    for message in kafka_queue.dequeue_processed_batch(max_records=len(messages_to_send), max_wait_ms=10000):
         logging.info(f"Received processed message: {message}")
 
-    # Close the KafkaQueue instance
+    # Close the queue instance
     kafka_queue.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Send test messages through the queue and read them back.")
+    parser.add_argument("--backend", choices=["kafka", "local"], default=QUEUE_BACKEND, help=f"Queue backend (default: {QUEUE_BACKEND})")
+    args = parser.parse_args()
+    main(args.backend)
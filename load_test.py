@@ -0,0 +1,135 @@
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from config import BASE_URLS
+from database_handling.DataDownload import DataDownloader
+from database_handling.DataUpload import DataUploader
+from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.ApiTransport import default_rate_limiter
+from load_testing.stub_server import M3StubServer
+
+def configure_logging(log_level):
+    logging.basicConfig(
+        level=getattr(logging, log_level.upper(), logging.INFO),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("load_test.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+def make_articles(count, prefix):
+    """Create synthetic processed articles of roughly realistic size."""
+    return [{"url": f"https://www.example.de/{prefix}/artikel-{i}",
+             "title": f"Artikel {i}",
+             "summary": "Zusammenfassung " * 40,
+             "medium": {"readable_id": "loadtest"},
+             "lead_bert": [0.1] * 768,
+             "full_bert": [0.1] * 768} for i in range(count)]
+
+def timed_map(function, items, concurrency):
+    """Run function over items with a thread pool and return the wall time, the per-call latencies and
+    the number of calls that failed with a request error, so that failures show up in the report
+    instead of aborting the run."""
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            function(item)
+            return time.perf_counter() - start, False
+        except requests.RequestException as e:
+            logging.debug(f"Request failed: {e}")
+            return time.perf_counter() - start, True
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, items))
+    return time.perf_counter() - start, [latency for latency, _ in outcomes], sum(failed for _, failed in outcomes)
+
+def report(logger, name, item_count, wall_time, latencies=None, errors=0):
+    line = f"{name:<8} {item_count:>7} items in {wall_time:7.2f} s = {item_count / wall_time:9.1f} items/s"
+    if latencies:
+        quantiles = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+        line += f" | latency p50 {statistics.median(latencies) * 1000:7.1f} ms, p95 {quantiles[18] * 1000:7.1f} ms"
+        line += f" | errors {errors} ({errors / len(latencies):.1%})"
+    logger.info(line)
+
+def run_load_test(article_count, known_fraction, concurrency, dedupe_batch_size):
+    """Measure token grant, upload, dedupe (rehydrate) and verification patch throughput."""
+    logger = logging.getLogger(__name__)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write("loadtest\nloadtest\n")
+        credentials_path = f.name
+    try:
+        start = time.perf_counter()
+        token = KeycloakLogin(credentials_path).get_token()
+        report(logger, "token", 1, time.perf_counter() - start)
+    finally:
+        os.remove(credentials_path)
+
+    # Upload: everything that will count as "already known" in the dedupe phase
+    known_articles = make_articles(int(article_count * known_fraction), "known")
+    data_uploader = DataUploader(token)
+    if known_articles:
+        wall_time, latencies, errors = timed_map(lambda article: data_uploader.post_content(article, raise_for_status=True), known_articles, concurrency)
+        report(logger, "upload", len(known_articles), wall_time, latencies, errors)
+
+    # Dedupe: check a crawl of known and new URLs against the database in rehydrate batches
+    crawled_urls = [article["url"] for article in known_articles + make_articles(article_count - len(known_articles), "new")]
+    batches = [crawled_urls[i:i + dedupe_batch_size] for i in range(0, len(crawled_urls), dedupe_batch_size)]
+    data_downloader = DataDownloader(token)
+    found_urls = []
+    wall_time, latencies, errors = timed_map(lambda batch: found_urls.extend(item['url'] for item in data_downloader.get_content_rehydrate(url=batch).get('items', [])), batches, concurrency)
+    report(logger, "dedupe", len(crawled_urls), wall_time, latencies, errors)
+    if len(found_urls) != len(known_articles):
+        logger.warning(f"Dedupe found {len(found_urls)} known URLs, expected {len(known_articles)}")
+
+    # Patch: re-verify all known URLs
+    start = time.perf_counter()
+    outcomes = data_uploader.patch_last_online_verification_date_bulk(found_urls, max_workers=concurrency)
+    report(logger, "patch", len(found_urls), time.perf_counter() - start)
+    failed = sum(1 for outcome in outcomes.values() if outcome["status"] == "failed")
+    if failed:
+        logger.warning(f"{failed} URLs could not be patched")
+
+    logger.info(f"Client-side throttling: {default_rate_limiter.stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the m3 client stack against a local stub of the m3 API and Keycloak.")
+    parser.add_argument("-n", "--articles", type=int, default=2000, help="Number of crawled articles (default: 2000)")
+    parser.add_argument("--known-fraction", type=float, default=0.8, help="Fraction of the crawl already in the database (default: 0.8)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of parallel client requests (default: 8)")
+    parser.add_argument("--dedupe-batch-size", type=int, default=30, help="URLs per rehydrate request (default: 30)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mean stub latency per request in milliseconds (default: 20)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests answered with 503 (default: 0)")
+    parser.add_argument("--server-rate-limit", type=float, help="Requests per second above which the stub answers 429 (default: unlimited)")
+    parser.add_argument("--max-url-length", type=int, default=8192, help="Longest request URI the stub accepts (default: 8192)")
+    parser.add_argument("--api-url", help="Use an already running stub at this base URL instead of starting one")
+    parser.add_argument("-l", "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level (default: INFO)")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+
+    server = None
+    if args.api_url:
+        api_base_url = args.api_url if args.api_url.endswith('/') else f"{args.api_url}/"
+        login_base_url = f"{api_base_url}auth/"
+    else:
+        server = M3StubServer(latency_ms=args.latency_ms, latency_jitter_ms=args.latency_ms / 2,
+                              error_rate=args.error_rate, max_url_length=args.max_url_length,
+                              requests_per_second=args.server_rate_limit).start()
+        api_base_url, login_base_url = server.api_base_url, server.login_base_url
+
+    # The clients read their base URLs from the config when they are constructed
+    BASE_URLS["m3-api-base"] = api_base_url
+    BASE_URLS["m3-login-base"] = login_base_url
+    try:
+        run_load_test(args.articles, args.known_fraction, args.concurrency, args.dedupe_batch_size)
+    finally:
+        if server is not None:
+            server.stop()
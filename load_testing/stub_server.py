@@ -0,0 +1,236 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+CONTENT_PATH = "/api/v1/content/"
+REHYDRATE_PATH = "/api/v1/content/rehydrate/"
+TOKEN_PATH = "/auth/realms/m3-api/protocol/openid-connect/token"
+
+class M3StubServer:
+    """A local stand-in for the m3 API and its Keycloak login, for load tests without production access.
+
+    Implements the endpoints used by DataDownloader, DataUploader, DataDeleter and KeycloakLogin:
+    paginated content listing, rehydrate, content upload, patch and delete, and the password token grant.
+    Content is kept in memory. Latency, error rate, payload limits and a server-side rate limit (answered
+    with 429 and Retry-After) are configurable so that client concurrency can be tuned against realistic conditions.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=20.0, latency_jitter_ms=10.0,
+                 error_rate=0.0, max_url_length=8192, max_body_bytes=10 * 1024 * 1024, token_lifetime=300,
+                 requests_per_second=None):
+        """Initialize the stub server; port 0 picks a free port."""
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.max_url_length = max_url_length
+        self.max_body_bytes = max_body_bytes
+        self.token_lifetime = token_lifetime
+        self.requests_per_second = requests_per_second
+        self._window_start = 0.0
+        self._window_count = 0
+        self.content_by_url = {}
+        self.content_by_id = {}
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def api_base_url(self):
+        """The base URL to use in place of BASE_URLS["m3-api-base"]."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def login_base_url(self):
+        """The base URL to use in place of BASE_URLS["m3-login-base"]."""
+        return f"{self.api_base_url}auth/"
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"m3 stub server listening on {self.api_base_url}")
+        return self
+
+    def stop(self):
+        """Shut the server down and wait for the serving thread."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        logger.info(f"m3 stub server stopped, requests served: {dict(self.request_counts)}")
+
+    def _simulate_latency(self):
+        delay = self.latency_ms + random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _over_rate_limit(self):
+        """Count the request in the current one-second window and report whether the limit is exceeded."""
+        if not self.requests_per_second:
+            return False
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > self.requests_per_second
+
+    @staticmethod
+    def _urls_from_query(query):
+        """Collect URLs from repeated url= parameters and from the ', '-joined form DataDownloader sends."""
+        urls = []
+        for value in query.get("url", []):
+            urls.extend(part.strip() for part in value.split(", ") if part.strip())
+        return urls
+
+    def _list_content(self, query):
+        page = int(query.get("page", ["1"])[0])
+        size = int(query.get("size", ["50"])[0])
+        urls = self._urls_from_query(query)
+        with self._lock:
+            items = [self.content_by_url[url] for url in urls if url in self.content_by_url] if urls else list(self.content_by_url.values())
+        total = len(items)
+        page_items = items[(page - 1) * size:page * size]
+        return 200, {"items": page_items, "total": total, "page": page, "size": size, "pages": -(-total // size) if size else 0}
+
+    def _rehydrate(self, query):
+        urls = self._urls_from_query(query)
+        with self._lock:
+            items = [self.content_by_url[url] for url in urls if url in self.content_by_url]
+        return 200, {"items": items}
+
+    def _post_content(self, data):
+        if not isinstance(data, dict) or "url" not in data:
+            return 422, {"detail": "content needs a url"}
+        with self._lock:
+            if data["url"] in self.content_by_url:
+                return 409, {"detail": f"content with url {data['url']} already exists"}
+            item = {**data, "id": str(uuid.uuid4())}
+            self.content_by_url[item["url"]] = item
+            self.content_by_id[item["id"]] = item
+        return 200, item
+
+    def _patch_content(self, query, data):
+        urls = self._urls_from_query(query)
+        updated = 0
+        with self._lock:
+            for url in urls:
+                if url in self.content_by_url:
+                    self.content_by_url[url].update(data)
+                    updated += 1
+        return 200, {"updated": updated}
+
+    def _delete_content(self, identifier):
+        with self._lock:
+            item = self.content_by_id.pop(identifier, None)
+            if item is None:
+                return 404, {"detail": "not found"}
+            self.content_by_url.pop(item["url"], None)
+        return 204, None
+
+    def _token(self):
+        return 200, {"access_token": uuid.uuid4().hex, "expires_in": self.token_lifetime,
+                     "refresh_expires_in": self.token_lifetime, "token_type": "Bearer", "scope": "openid"}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+            def _send(self, status, payload, extra_headers=None):
+                body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (extra_headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                split = urlsplit(self.path)
+                query = parse_qs(split.query)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with stub._lock:
+                    stub.request_counts[f"{method} {split.path}"] += 1
+                stub._simulate_latency()
+
+                if len(self.path) > stub.max_url_length:
+                    return self._send(414, {"detail": "URI too long"})
+                if len(body) > stub.max_body_bytes:
+                    return self._send(413, {"detail": "payload too large"})
+                if split.path == TOKEN_PATH:
+                    return self._send(*stub._token())
+                if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+                    return self._send(401, {"detail": "not authenticated"})
+                if stub._over_rate_limit():
+                    stub.request_counts["429"] += 1
+                    return self._send(429, {"detail": "too many requests"}, {"Retry-After": "1"})
+                if random.random() < stub.error_rate:
+                    return self._send(503, {"detail": "simulated outage"}, {"Retry-After": "1"})
+
+                data = json.loads(body) if body else None
+                if method == "GET" and split.path == REHYDRATE_PATH:
+                    return self._send(*stub._rehydrate(query))
+                if method == "GET" and split.path == CONTENT_PATH:
+                    return self._send(*stub._list_content(query))
+                if method == "POST" and split.path == CONTENT_PATH:
+                    return self._send(*stub._post_content(data))
+                if method == "PATCH" and split.path == CONTENT_PATH:
+                    return self._send(*stub._patch_content(query, data or {}))
+                if method == "DELETE" and split.path.startswith(CONTENT_PATH):
+                    return self._send(*stub._delete_content(split.path[len(CONTENT_PATH):].strip("/")))
+                return self._send(404, {"detail": "not found"})
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the m3 API and its Keycloak login.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8900, help="Port to bind (default: 8900)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mean latency per request in milliseconds (default: 20)")
+    parser.add_argument("--latency-jitter-ms", type=float, default=10.0, help="Uniform jitter around the mean latency (default: 10)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503 (default: 0)")
+    parser.add_argument("--max-url-length", type=int, default=8192, help="Longest accepted request URI, longer ones get 414 (default: 8192)")
+    parser.add_argument("--requests-per-second", type=float, help="Answer requests above this rate with 429 (default: unlimited)")
+    parser.add_argument("--max-body-bytes", type=int, default=10 * 1024 * 1024, help="Largest accepted body, larger ones get 413 (default: 10 MiB)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = M3StubServer(args.host, args.port, args.latency_ms, args.latency_jitter_ms,
+                          args.error_rate, args.max_url_length, args.max_body_bytes,
+                          requests_per_second=args.requests_per_second).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import logging
+import random
+import time
+
+import numpy as np
+
+from kafka_queue import wire_format
+from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION
+
+logger = logging.getLogger(__name__)
+
+# Embedding sizes of the vectorization models (base models 768, large models 1024)
+EMBEDDING_DIMENSIONS = {"bert": 768, "roberta": 768}
+
+def make_processed_record(seed):
+    """A processed record shaped like the output of the pipeline: metadata, analysis results and
+    a lead and a full text embedding per vectorization model."""
+    rng = random.Random(seed)
+    record = {
+        "url": f"https://www.example.com/article/{seed}",
+        "title": "Beispielartikel " * 4,
+        "medium": {"name": "example"},
+        "published_date": "2024-10-18T12:00:00",
+        "summary": "Eine kurze Zusammenfassung des Artikels. " * 5,
+        "topic": "Politik",
+        "central_entities": [{"entity": f"Entity {i}", "type": rng.choice(["PER", "ORG", "LOC"]), "count": rng.randint(1, 9)}
+                             for i in range(10)],
+    }
+    for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION:
+        dimensions = EMBEDDING_DIMENSIONS.get(key, 1024)
+        for prefix in ("lead", "full"):
+            # Like Vectorizer: float32 embeddings converted with tolist()
+            record[f"{prefix}_{key}"] = np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32).tolist()
+    return record
+
+def benchmark(records, wire_format_name, repeat):
+    """Return bytes per record and encode/decode time per record in microseconds (best of repeat)."""
+    encoded = [wire_format.encode(record, wire_format_name) for record in records]
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            wire_format.encode(record, wire_format_name)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for data in encoded:
+            wire_format.decode(data)
+        decode_times.append(time.perf_counter() - start)
+    return {
+        "format": wire_format_name,
+        "bytes_per_record": sum(len(data) for data in encoded) / len(encoded),
+        "encode_us_per_record": min(encode_times) / len(records) * 1e6,
+        "decode_us_per_record": min(decode_times) / len(records) * 1e6,
+    }
+
+def check_round_trip(record):
+    """The binary format must give back the same record, with embeddings exact up to float32."""
+    decoded = wire_format.decode(wire_format.encode(record, "msgpack"))
+    assert decoded.keys() == record.keys()
+    # Embeddings come back as zero-copy views, which the JSON writers serialize through json_default
+    json.dumps(decoded, default=wire_format.json_default)
+    for key, value in record.items():
+        if key in wire_format.EMBEDDING_FIELDS:
+            assert isinstance(decoded[key], np.ndarray) and not decoded[key].flags.writeable, key
+            assert np.array_equal(decoded[key], np.asarray(value, dtype=np.float32)), key
+        else:
+            assert decoded[key] == value, key
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the JSON and the binary wire format of processed records.")
+    parser.add_argument("-n", "--records", type=int, default=200, help="Number of records (default: 200)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Repetitions, the best one counts (default: 5)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    records = [make_processed_record(seed) for seed in range(args.records)]
+    check_round_trip(records[0])
+    results = [benchmark(records, name, args.repeat) for name in ("json", "msgpack")]
+    for result in results:
+        logger.info(f"{result['format']:>8}: {result['bytes_per_record']:>10.0f} bytes/record, "
+                    f"encode {result['encode_us_per_record']:>8.1f} us/record, decode {result['decode_us_per_record']:>8.1f} us/record")
+    print(json.dumps(results, indent=2))
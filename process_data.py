@@ -1,23 +1,30 @@
+import copy
 import json
 import os
 import logging
+import argparse
 import gc
 import torch
 import threading
-from queue import Queue
-from kafka_queue.kafka_manager import KafkaQueue  # Import KafkaQueue
+import multiprocessing
+from kafka_queue.queue_factory import create_queue
+from kafka_queue.processed_url_store import ProcessedUrlStore
+from kafka_queue.hand_off import BoundedHandOff
+from kafka_queue.blob_store import BlobStore, check_out, without_texts
+from database_handling.RetryStore import RetryStore
+from config import KAFKA_CONSUMER_SETTINGS, HAND_OFF_SETTINGS, CLAIM_CHECK_SETTINGS, RETRY_SETTINGS
 import time
 
-# from text_analysis.NEExtractor import NEExtractor
-# from text_analysis.Summarizer import Summarizer
-# from text_analysis.TopicExtractor import TopicExtractor
-# from text_analysis.Vectorizers import Vectorizer
+from text_analysis.NEExtractor import NEExtractor
+from text_analysis.Summarizer import Summarizer
+from text_analysis.TopicExtractor import TopicExtractor
+from text_analysis.Vectorizers import Vectorizer
 
 def configure_logging(log_level="INFO"):
     numeric_level = getattr(logging, log_level.upper(), logging.INFO)
     logging.basicConfig(
         level=numeric_level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
+        format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler("process_queue.log"),
             logging.StreamHandler()
@@ -31,10 +38,11 @@ def clear_gpu_memory():
     gc.collect()
     logging.info("GPU memory cleared and garbage collection performed")
 
-def process_articles_in_batches(text_analysis_class, method_name, articles, batch_size):
-    """Process articles in batches using the specified text analysis class and method."""
-    processor = text_analysis_class()
-    method = getattr(processor, method_name)
+def process_articles_in_batches(method, articles, batch_size):
+    """Process articles in batches with the analysis method of an already loaded processor.
+    Returns a dict of URL -> error for the articles that failed."""
+    method_name = method.__name__
+    failed = {}
 
     for i in range(0, len(articles), batch_size):
         logging.info(f"Processing batch {i // batch_size + 1} of {method_name} for articles {i} to {i + batch_size}")
@@ -49,86 +57,192 @@ def process_articles_in_batches(text_analysis_class, method_name, articles, batc
             else:
                 logging.error(f"Unexpected error during {method_name} in batch {i // batch_size + 1}: {str(e)}")
                 clear_gpu_memory()
+            # Retry the articles one by one, so that a single failing article does not cost the whole batch
+            for j, article in enumerate(batch):
+                try:
+                    batch[j] = method([article])[0]
+                except RuntimeError as e:
+                    logging.error(f"Error during {method_name} for article {article['url']}: {str(e)}")
+                    failed[article['url']] = f"{method_name}: {e}"
+                    clear_gpu_memory()
 
         articles[i:i + batch_size] = batch
         clear_gpu_memory()
 
-    del processor
-    clear_gpu_memory()
     logging.info(f"{method_name} processing completed for all articles")
+    return failed
+
+def hand_over(kafka_queue, hand_off, item, stop_event, max_wait_ms):
+    """Put a batch into the bounded hand-off. While it is full, the Kafka partitions are paused and only
+    polled to stay in the consumer group, so the broker keeps the backlog instead of this process."""
+    if hand_off.put(item, timeout=0):
+        return True
+    logging.info(f"Hand-off buffer full with {hand_off.max_batches} batches, pausing consumption")
+    kafka_queue.pause()
+    start = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            if hand_off.put(item, timeout=max_wait_ms / 1000):
+                return True
+            kafka_queue.commit_processed()
+            kafka_queue.poll_paused(timeout_ms=0)
+        return False
+    finally:
+        kafka_queue.resume()
+        hand_off.record_pause(time.monotonic() - start)
+        logging.info(f"Resumed consumption after {time.monotonic() - start:.1f} seconds")
 
-def process_queue(kafka_queue, processing_queue):
+def process_queue(kafka_queue, hand_off, stop_event, max_records=KAFKA_CONSUMER_SETTINGS["max_records"], max_wait_ms=KAFKA_CONSUMER_SETTINGS["max_wait_ms"]):
+    """Consume micro-batches from Kafka and hand each batch, with its offsets, to the processing thread as a whole.
+    Offsets are committed here, in the polling thread, once the processing thread marked them as processed."""
     logger = configure_logging()
-    logger.info("Starting queue processing")
+    logger.info(f"Starting queue processing with batches of up to {max_records} messages or {max_wait_ms} ms")
+    last_report = time.monotonic()
+    retry_store = RetryStore()
+    last_retry_check = time.monotonic()
 
     try:
-        while True:  # Continuous loop to keep processing messages
-            articles = []
-            message_limit = 1  # Set a limit for the number of messages to process
-
-            # Use a loop to consume messages from the generator
-            for _ in range(message_limit):
-                try:
-                    message = next(kafka_queue.dequeue())  # Get the next message from the generator
-                    if message:
-                        articles.append(message)  # Ensure message is added to the list
-                        logger.info(f"Received message: {message}")
-                    else:
-                        logger.info("No more messages to process.")
-                        break
-                except StopIteration:
-                    logger.info("No more messages in the queue.")
-                    break
-
-            if articles:
-                logger.info(f"Loaded {len(articles)} items from Kafka queue")
-                # Add articles to the processing queue
-                for article in articles:
-                    processing_queue.put(article)
-                    print(article)
-            else:
-                logger.info("No articles to process. Waiting for new messages...")
-                time.sleep(5)  # Wait for 5 seconds before checking again
+        while not stop_event.is_set():
+            kafka_queue.commit_processed()
+            if time.monotonic() - last_report >= HAND_OFF_SETTINGS["report_interval"]:
+                hand_off.log_stats()
+                last_report = time.monotonic()
+            if time.monotonic() - last_retry_check >= RETRY_SETTINGS["poll_interval"]:
+                # Failed articles whose retry is due join the stream as batches without offsets
+                retries = retry_store.claim_due(limit=max_records)
+                if retries:
+                    hand_over(kafka_queue, hand_off, (retries, {}), stop_event, max_wait_ms)
+                last_retry_check = time.monotonic()
+            batch, offsets = kafka_queue.dequeue_batch(max_records, max_wait_ms, with_offsets=True)
+            if not batch:
+                continue
+            # A message is either a single article or a list of articles
+            articles = [article for message in batch for article in (message if isinstance(message, list) else [message])]
+            logger.info(f"Loaded {len(articles)} articles from {len(batch)} Kafka messages")
+            hand_over(kafka_queue, hand_off, (articles, offsets), stop_event, max_wait_ms)
 
     except Exception as e:
         logger.error(f"Error in process_queue: {str(e)}")
     finally:
-        kafka_queue.close()  # Ensure the Kafka consumer is closed
-
-def process_articles(processing_queue):
+        retry_store.close()
+
+def forward_processed(kafka_queue, articles, attempts=3):
+    """Send processed articles to the processed topic and wait until the broker acknowledged them.
+    Returns True on success."""
+    for attempt in range(1, attempts + 1):
+        future = kafka_queue.enqueue_processed(articles)
+        kafka_queue.flush()  # Checkpoint once per processed batch
+        if future.succeeded():
+            return True
+        logging.warning(f"Forwarding {len(articles)} processed articles failed (attempt {attempt} of {attempts}): {future.exception}")
+    return False
+
+ANALYSIS_STAGES = [(NEExtractor, 'extract_entities'), (Summarizer, 'summarize'),
+                   (TopicExtractor, 'extract_topics'), (Vectorizer, 'vectorize')]
+
+def load_analysis_methods():
+    """Load the models of every analysis stage once per worker and return the bound analysis methods."""
+    methods = []
+    for text_analysis_class, method_name in ANALYSIS_STAGES:
+        logging.info(f"Loading {text_analysis_class.__name__} for {method_name}")
+        methods.append(getattr(text_analysis_class(), method_name))
+    return methods
+
+def process_articles(hand_off, kafka_queue, stop_event):
     logger = configure_logging()
     logger.info("Starting article processing")
+    processed_url_store = ProcessedUrlStore()
+    retry_store = RetryStore()
+    blob_store = BlobStore() if CLAIM_CHECK_SETTINGS["enabled"] else None
+    analysis_methods = load_analysis_methods()
 
     while True:
-        articles = processing_queue.get()  # Get an article from the processing queue
-        if articles is None:  # Check for termination signal
+        item = hand_off.get()  # Get a batch of articles from the hand-off buffer
+        if item is None:  # Check for termination signal
             break
+        articles, offsets = item
+
+        # Articles redelivered after a crash were already forwarded, skip them before any model runs
+        unprocessed = processed_url_store.filter_unprocessed(articles)
+        # A claimed retry of an article processed in the meantime would otherwise come back at every lease expiry
+        unprocessed_urls = {article['url'] for article in unprocessed}
+        retry_store.resolve(article['url'] for article in articles if article['url'] not in unprocessed_urls)
+        articles = unprocessed
+        # The articles as they came from the queue, before texts are checked out and stages add their fields:
+        # a retry starts from this copy and must hash like the original scrape
+        originals = {article['url']: copy.deepcopy(article) for article in articles}
+        processed_keys = {url: processed_url_store.key(original) for url, original in originals.items()}
+
+        if articles:
+            if blob_store is not None:
+                check_out(articles, blob_store)
+            # The whole micro-batch goes through every stage at once
+            for method in analysis_methods:
+                failed = process_articles_in_batches(method, articles, len(articles))
+                if failed:
+                    # Failed articles leave the batch and come back through the retry store
+                    for article in articles:
+                        if article['url'] in failed:
+                            retry_store.record_failure(originals[article['url']], method.__name__, failed[article['url']])
+                    articles = [article for article in articles if article['url'] not in failed]
+                    if not articles:
+                        break
 
-        # Process the article
-        # Uncomment and adjust the following lines as needed
-        # processed_article = process_articles_in_batches(NEExtractor, 'extract_entities', articles, 1)
-        # processed_article = process_articles_in_batches(Summarizer, 'summarize', articles, 1)
-        # processed_article = process_articles_in_batches(TopicExtractor, 'extract_topics', articles, 1)
-        # processed_article = process_articles_in_batches(Vectorizer, 'vectorize', articles, 1)
-
-        # Remove unnecessary fields
-        articles = [{k: v for k, v in art.items() if k not in ['main_text', 'lead_text']} for art in articles]
-        # Produce processed articles back to the processed topic
-        kafka_queue.enqueue_processed(articles)
-        logger.info(f"Processed articles sent to {kafka_queue.processed_topic}")
-        logger.info(f"Processed articles: {articles}")
-
-if __name__ == "__main__":
-    kafka_queue = KafkaQueue(topic='raw_articles')
-    processing_queue = Queue()  # Create a queue for processing articles
+        if articles:
+            # Remove unnecessary fields
+            articles = [without_texts(art) for art in articles]
+            # Produce processed articles back to the processed topic
+            if not forward_processed(kafka_queue, articles):
+                # Committing later batches would skip this one, so stop and let it be redelivered after a restart
+                logger.critical(f"Could not forward {len(articles)} processed articles, stopping without committing them")
+                stop_event.set()
+                break
+            processed_url_store.mark(processed_keys[article['url']] for article in articles)
+            retry_store.resolve(article['url'] for article in articles)
+            logger.info(f"Processed {len(articles)} articles sent to {kafka_queue.processed_topic}")
+
+        # Only now may the offsets of the batch be committed
+        kafka_queue.mark_processed(offsets)
+
+    processed_url_store.close()
+    retry_store.close()
+
+def run_worker(max_records, max_wait_ms, max_batches=HAND_OFF_SETTINGS["max_batches"]):
+    """Run one consumer with its processing thread. All workers share the consumer group of
+    the queue, so Kafka assigns each of them its own partitions of the raw article topic."""
+    kafka_queue = create_queue(topic='raw_articles', manual_commit=True)
+    hand_off = BoundedHandOff(max_batches)  # Bounded buffer of batches waiting for the models
+    stop_event = threading.Event()
 
     # Start the processing thread
-    processing_thread = threading.Thread(target=process_articles, args=(processing_queue,))
+    processing_thread = threading.Thread(target=process_articles, args=(hand_off, kafka_queue, stop_event))
     processing_thread.start()
 
     # Start the main queue processing
-    process_queue(kafka_queue, processing_queue)
+    process_queue(kafka_queue, hand_off, stop_event, max_records, max_wait_ms)
 
     # Signal the processing thread to terminate
-    processing_queue.put(None)  # Send termination signal
+    hand_off.put_termination(processing_thread.is_alive)  # Send termination signal
     processing_thread.join()  # Wait for the processing thread to finish
+    hand_off.log_stats()
+    kafka_queue.close()  # Flushes the producer and commits the offsets of all processed batches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process scraped articles from the Kafka queue.")
+    parser.add_argument("-b", "--batch-size", type=int, default=KAFKA_CONSUMER_SETTINGS["max_records"], help=f"Maximum number of messages per batch (default: {KAFKA_CONSUMER_SETTINGS['max_records']})")
+    parser.add_argument("-t", "--max-wait-ms", type=int, default=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], help=f"Maximum time to wait for a batch to fill in milliseconds (default: {KAFKA_CONSUMER_SETTINGS['max_wait_ms']})")
+    parser.add_argument("-n", "--workers", type=int, default=1, help="Number of worker processes in the consumer group; the topic needs at least as many partitions (default: 1)")
+    parser.add_argument("-q", "--buffer-batches", type=int, default=HAND_OFF_SETTINGS["max_batches"], help=f"Maximum number of batches waiting for the models before Kafka consumption pauses (default: {HAND_OFF_SETTINGS['max_batches']})")
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_worker(args.batch_size, args.max_wait_ms, args.buffer_batches)
+    else:
+        # Spawn instead of fork, so that every worker initializes CUDA and its models on its own
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=run_worker, args=(args.batch_size, args.max_wait_ms, args.buffer_batches), name=f"worker-{i}")
+                   for i in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,239 @@
+import argparse
+import gc
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from kafka_queue.queue_factory import create_queue
+from kafka_queue.blob_store import BlobStore, TEXT_FIELDS, check_out, without_texts
+from kafka_queue.wire_format import json_default
+from database_handling.RetryStore import RetryStore
+from config import KAFKA_CONSUMER_SETTINGS, PIPELINE_TOPICS, PIPELINE_STAGES, PIPELINE_MERGE_STORE_PATH, CLAIM_CHECK_SETTINGS, \
+    RETRY_SETTINGS, STAGE_INPUTS
+
+# Staged analysis pipeline. Every analysis stage runs in its own worker processes, consumes the raw
+# articles in its own consumer group and emits only its own output fields, keyed by URL, to the results
+# topic. Keying by URL puts all results of an article on the same partition, so exactly one merge worker
+# sees all of them and assembles the final record, which goes to the output topic for upload.py --from-queue.
+# An article that fails in a stage is retried by that stage through its own retry store; the merge only
+# emits it once every stage succeeded. Each stage can be scaled on its own, e.g.:
+#
+#   python process_stage.py --stage ner
+#   python process_stage.py --stage summary --workers 4
+#   python process_stage.py --stage merge
+#   python upload.py --from-queue
+
+def configure_logging(log_level="INFO"):
+    numeric_level = getattr(logging, log_level.upper(), logging.INFO)
+    logging.basicConfig(
+        level=numeric_level,
+        format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("process_stage.log"),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def clear_gpu_memory():
+    """Clears GPU memory, if torch is in use, and forces garbage collection."""
+    try:
+        import torch
+        torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    gc.collect()
+
+def load_stage_method(stage):
+    """Instantiate the analysis class of a stage once and return its analysis method,
+    or None for the metadata stage, which only forwards the scraped fields."""
+    class_path, method_name = PIPELINE_STAGES[stage]
+    if class_path is None:
+        return None
+    module_name, class_name = class_path.rsplit('.', 1)
+    text_analysis_class = getattr(importlib.import_module(module_name), class_name)
+    logging.info(f"Loading {class_name} for stage {stage}")
+    return getattr(text_analysis_class(), method_name)
+
+def flatten(messages):
+    """A message is either a single article or a list of articles."""
+    return [article for message in messages for article in (message if isinstance(message, list) else [message])]
+
+def analyze_batch(stage, method, articles, blob_store=None):
+    """Run a stage over a batch and return one result per article with only the fields the stage added.
+    With claim checks, only the texts the stage reads are fetched from the blob store."""
+    if method is None:
+        return [{"url": article['url'], "stage": stage, "error": None, "fields": without_texts(article)} for article in articles]
+
+    if blob_store is not None:
+        check_out(articles, blob_store, STAGE_INPUTS.get(method.__name__, TEXT_FIELDS))
+    original_fields = [set(article) for article in articles]
+    errors = {}
+    try:
+        method(articles)
+    except RuntimeError as e:
+        # Fall back to one article at a time, so that a single failing article does not cost the whole batch
+        logging.error(f"Stage {stage} failed for a batch of {len(articles)} articles, retrying them one by one: {e}")
+        clear_gpu_memory()
+        for article in articles:
+            try:
+                method([article])
+            except RuntimeError as e:
+                logging.error(f"Stage {stage} failed for {article['url']}: {e}")
+                errors[article['url']] = str(e)
+                clear_gpu_memory()
+
+    return [{"url": article['url'], "stage": stage, "error": errors.get(article['url']),
+             "fields": {k: v for k, v in article.items() if k not in fields}}
+            for article, fields in zip(articles, original_fields)]
+
+def forward(kafka_queue, records):
+    """Send records keyed by URL and wait until the broker acknowledged all of them. Returns True on success."""
+    futures = [kafka_queue.enqueue_processed(record, key=kafka_queue.article_key(record)) for record in records]
+    kafka_queue.flush()
+    return all(future.succeeded() for future in futures)
+
+def stage_retry_store_path(stage):
+    """Every stage keeps its failures in its own retry store, so that failures of the same article in
+    different stages do not overwrite each other."""
+    root, extension = os.path.splitext(RETRY_SETTINGS["path"])
+    return f"{root}_{stage}{extension}"
+
+def run_stage(stage, max_records, max_wait_ms):
+    """Consume raw articles in the consumer group of the stage and emit the stage results.
+    Articles that fail are recorded in the retry store of the stage and analyzed again once their retry is due."""
+    logger = configure_logging()
+    method = load_stage_method(stage)
+    blob_store = BlobStore() if CLAIM_CHECK_SETTINGS["enabled"] else None
+    retry_store = RetryStore(stage_retry_store_path(stage))
+    kafka_queue = create_queue(topic=PIPELINE_TOPICS["input"], processed_topic=PIPELINE_TOPICS["results"],
+                             manual_commit=True, group_id=f"stage_{stage}")
+    logger.info(f"Stage {stage} consuming {PIPELINE_TOPICS['input']} and producing to {PIPELINE_TOPICS['results']}")
+    last_retry_check = time.monotonic()
+    try:
+        while True:
+            kafka_queue.commit_processed()
+            if time.monotonic() - last_retry_check >= RETRY_SETTINGS["poll_interval"]:
+                # Failed articles whose retry is due are analyzed as a batch without offsets
+                messages, offsets = retry_store.claim_due(limit=max_records), {}
+                last_retry_check = time.monotonic()
+            else:
+                messages, offsets = kafka_queue.dequeue_batch(max_records, max_wait_ms, with_offsets=True)
+            if not messages:
+                continue
+            articles = flatten(messages)
+            # The results replace the input fields, so keep the articles as they came for a retry
+            inputs = {article['url']: dict(article) for article in articles}
+            results = analyze_batch(stage, method, articles, blob_store)
+            clear_gpu_memory()
+            if not forward(kafka_queue, results):
+                logger.critical(f"Could not forward {len(results)} results of stage {stage}, stopping without committing them")
+                break
+            for result in results:
+                if result["error"]:
+                    retry_store.record_failure(inputs[result['url']], stage, result["error"])
+            retry_store.resolve(result['url'] for result in results if not result["error"])
+            kafka_queue.mark_processed(offsets)
+            logger.info(f"Stage {stage} processed {len(articles)} articles")
+    finally:
+        kafka_queue.close()
+        retry_store.close()
+
+
+class MergeStore:
+    """Keeps the partial stage results of articles in SQLite until the results of all stages arrived,
+    so that committed offsets never lose a partial result when the merge worker restarts."""
+
+    def __init__(self, path=PIPELINE_MERGE_STORE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS partials (url TEXT, stage TEXT, result TEXT, PRIMARY KEY (url, stage))")
+        self._connection.commit()
+
+    def add(self, results):
+        self._connection.executemany("INSERT OR REPLACE INTO partials (url, stage, result) VALUES (?, ?, ?)",
+                                     [(result['url'], result['stage'], json.dumps(result, default=json_default)) for result in results])
+        self._connection.commit()
+
+    def results_for(self, url):
+        rows = self._connection.execute("SELECT result FROM partials WHERE url = ?", (url,)).fetchall()
+        return {result['stage']: result for result in (json.loads(row[0]) for row in rows)}
+
+    def remove(self, urls):
+        self._connection.executemany("DELETE FROM partials WHERE url = ?", [(url,) for url in urls])
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+def merge_results(results_by_stage):
+    """Assemble the final record: the scraped metadata plus the output fields of every analysis stage."""
+    record = dict(results_by_stage["metadata"]["fields"])
+    for stage, result in results_by_stage.items():
+        if stage != "metadata":
+            record.update(result["fields"])
+    return record
+
+def is_complete(results_by_stage, required_stages):
+    """Whether all required stages reported successfully. A failed stage result stays in the merge store
+    until the retry of that stage replaces it, so incomplete records are never emitted."""
+    return all(stage in results_by_stage and not results_by_stage[stage]["error"] for stage in required_stages)
+
+def run_merge(max_records, max_wait_ms, required_stages):
+    """Join the stage results per URL and emit the final records once all required stages reported."""
+    logger = configure_logging()
+    required_stages = set(required_stages) | {"metadata"}
+    kafka_queue = create_queue(topic=PIPELINE_TOPICS["results"], processed_topic=PIPELINE_TOPICS["output"],
+                             manual_commit=True, group_id="stage_merge")
+    merge_store = MergeStore()
+    logger.info(f"Merging results of stages {sorted(required_stages)} into {PIPELINE_TOPICS['output']}")
+    try:
+        for results, offsets in kafka_queue.consume_batches(max_records, max_wait_ms, with_offsets=True):
+            merge_store.add(results)
+            records = []
+            for url in dict.fromkeys(result['url'] for result in results):
+                results_by_stage = merge_store.results_for(url)
+                if is_complete(results_by_stage, required_stages):
+                    records.append(merge_results(results_by_stage))
+                else:
+                    for stage, result in results_by_stage.items():
+                        if result["error"]:
+                            logger.info(f"Holding back {url} until stage {stage} succeeds on retry: {result['error']}")
+            if records and not forward(kafka_queue, records):
+                logger.critical(f"Could not forward {len(records)} merged records, stopping without committing them")
+                break
+            merge_store.remove(record['url'] for record in records)
+            kafka_queue.mark_processed(offsets)
+            if records:
+                logger.info(f"Merged {len(records)} articles")
+    finally:
+        kafka_queue.close()
+        merge_store.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one stage of the staged analysis pipeline.")
+    parser.add_argument("-s", "--stage", required=True, choices=list(PIPELINE_STAGES) + ["merge"], help="The stage to run")
+    parser.add_argument("-n", "--workers", type=int, default=1, help="Number of worker processes for this stage; the consumed topic needs at least as many partitions (default: 1)")
+    parser.add_argument("-b", "--batch-size", type=int, default=KAFKA_CONSUMER_SETTINGS["max_records"], help=f"Maximum number of messages per batch (default: {KAFKA_CONSUMER_SETTINGS['max_records']})")
+    parser.add_argument("-t", "--max-wait-ms", type=int, default=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], help=f"Maximum time to wait for a batch to fill in milliseconds (default: {KAFKA_CONSUMER_SETTINGS['max_wait_ms']})")
+    parser.add_argument("--merge-stages", nargs="+", default=list(PIPELINE_STAGES), choices=list(PIPELINE_STAGES), help="Stages the merge stage waits for (default: all)")
+    args = parser.parse_args()
+
+    if args.stage == "merge":
+        target, target_args = run_merge, (args.batch_size, args.max_wait_ms, args.merge_stages)
+    else:
+        target, target_args = run_stage, (args.stage, args.batch_size, args.max_wait_ms)
+
+    if args.workers == 1:
+        target(*target_args)
+    else:
+        # Spawn instead of fork, so that every worker initializes CUDA and its model on its own
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=target, args=target_args, name=f"{args.stage}-{i}") for i in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
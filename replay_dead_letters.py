@@ -0,0 +1,64 @@
+import argparse
+import json
+import logging
+from database_handling.RetryStore import RetryStore, UPLOAD_STAGE
+from database_handling.UploadSpool import UploadSpool
+from kafka_queue.queue_factory import create_queue
+from config import RETRY_SETTINGS, UPLOAD_SPOOL_PATH
+
+def configure_logging(log_level):
+    logging.basicConfig(
+        level=getattr(logging, log_level.upper(), logging.INFO),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("replay_dead_letters.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+def list_dead_letters(retry_store, stage=None, urls=None):
+    for letter in retry_store.dead_letters(stage, urls):
+        print(json.dumps({k: v for k, v in letter.items() if k != "article"}))
+
+def replay_dead_letters(retry_store, stage=None, urls=None, spool_path=UPLOAD_SPOOL_PATH):
+    """Give dead letters a fresh attempt budget: failed uploads go back to the upload spool (drain with
+    drain_spool.py), articles that failed in an analysis stage go back to the raw article topic.
+    Returns the number of replayed articles."""
+    logger = logging.getLogger(__name__)
+    letters = retry_store.dead_letters(stage, urls)
+    uploads = [letter["article"] for letter in letters if letter["stage"] == UPLOAD_STAGE]
+    analyses = [letter["article"] for letter in letters if letter["stage"] != UPLOAD_STAGE]
+
+    if uploads:
+        UploadSpool(spool_path).append(uploads)
+        logger.info(f"Replayed {len(uploads)} failed uploads to {spool_path}")
+    if analyses:
+        queue = create_queue()
+        enqueued = queue.enqueue_articles(analyses)
+        queue.flush()
+        queue.close()
+        if enqueued < len(analyses):
+            raise RuntimeError(f"Only {enqueued} of {len(analyses)} articles could be enqueued, dead letters kept")
+        logger.info(f"Replayed {len(analyses)} failed analyses to {queue.topic}")
+
+    # Only now that the articles are back in the pipeline, their dead letters can go
+    retry_store.remove(letter["url"] for letter in letters)
+    return len(letters)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or replay articles that ran out of retry attempts.")
+    parser.add_argument("action", choices=["list", "replay"], help="List the dead letters or replay them")
+    parser.add_argument("--stage", help="Only dead letters that last failed in this stage, e.g. summarize or upload")
+    parser.add_argument("--url", nargs="+", help="Only the dead letters of these URLs")
+    parser.add_argument("--store", default=RETRY_SETTINGS["path"], help=f"Path of the retry store (default: {RETRY_SETTINGS['path']})")
+    parser.add_argument("-s", "--spool", default=UPLOAD_SPOOL_PATH, help=f"Path of the upload spool (default: {UPLOAD_SPOOL_PATH})")
+    parser.add_argument("-l", "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level (default: INFO)")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    retry_store = RetryStore(args.store)
+    if args.action == "list":
+        list_dead_letters(retry_store, args.stage, args.url)
+    else:
+        replay_dead_letters(retry_store, args.stage, args.url, args.spool)
+    retry_store.close()
@@ -6,9 +6,10 @@ from tqdm import tqdm
 from database_handling.DataDownload import DataDownloader
 from database_handling.DataUpload import DataUploader
 from database_handling.KeycloakLogin import KeycloakLogin
-from config import SCRAPER_MAP
+from config import SCRAPER_MAP, CLAIM_CHECK_SETTINGS
 import importlib
-from kafka_queue.kafka_manager import KafkaQueue  # Import the KafkaQueue class
+from kafka_queue.queue_factory import create_queue
+from kafka_queue.blob_store import BlobStore, check_in
 
 def configure_logging(log_level):
     logging.basicConfig(
@@ -90,8 +91,8 @@ def check_and_download(website):
         # new_urls = [url for url in all_found_urls if url not in all_urls_already_in_db]
         # logging.info(f"Found {len(new_urls)} new URLs to scrape")
 
-        # Initialize Kafka queue
-        kafka_queue = KafkaQueue()
+        # Initialize the queue, Kafka or the local log depending on QUEUE_BACKEND
+        kafka_queue = create_queue()
 
         # Download content for new URLs
         # new_content = []
@@ -108,8 +109,14 @@ def check_and_download(website):
                 {'main_text': 'Test article 3', 'lead_text': 'Lead text for article 3', 'url': 'http://testurl3.com'}
             ]
 
-            # Send the entire batch of scraped articles to Kafka
-            kafka_queue.enqueue(new_content)  # Send the entire list of articles to Kafka
+            if CLAIM_CHECK_SETTINGS["enabled"]:
+                # Only references to the texts travel through the queue
+                check_in(new_content, BlobStore())
+
+            # Send every scraped article as its own message, keyed by its URL
+            kafka_queue.enqueue_articles(new_content)
+            # Checkpoint: the producer batches in the background, wait until the crawl is delivered
+            kafka_queue.flush()
             logging.info(f"New content sent to Kafka: {len(new_content)} articles")
 
         except Exception as e:
@@ -1,4 +1,5 @@
 import argparse
+import copy
 import importlib
 import logging
 import transformers
@@ -10,6 +11,9 @@ from config import SCRAPER_MAP
 from database_handling.DataDownload import DataDownloader
 from database_handling.DataUpload import DataUploader
 from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.UploadSpool import UploadSpool
+from database_handling.RetryStore import RetryStore, UPLOAD_STAGE
+from database_handling.ContentChangeDetector import ContentChangeDetector
 from text_analysis.NEExtractor import NEExtractor
 from text_analysis.Summarizer import Summarizer
 from text_analysis.TopicExtractor import TopicExtractor
@@ -46,9 +50,11 @@ def clear_gpu_memory():
     logger.info("GPU memory cleared and garbage collection performed")
 
 def process_articles_in_batches(text_analysis_class, method_name, articles, batch_size):
-    """Process articles in batches using the specified text analysis class and method."""
+    """Process articles in batches using the specified text analysis class and method.
+    Returns a dict of URL -> error for the articles that failed."""
     processor = text_analysis_class()
     method = getattr(processor, method_name)
+    failed = {}
 
     for i in range(0, len(articles), batch_size):
         logger.info(f"Processing batch {i // batch_size + 1} of {method_name} for articles {i} to {i + batch_size}")
@@ -63,6 +69,14 @@ def process_articles_in_batches(text_analysis_class, method_name, articles, batc
             else:
                 logger.error(f"Unexpected error during {method_name} in batch {i // batch_size + 1}: {str(e)}")
                 clear_gpu_memory()
+            # Retry the articles one by one, so that a single failing article does not cost the whole batch
+            for j, article in enumerate(batch):
+                try:
+                    batch[j] = method([article])[0]
+                except RuntimeError as e:
+                    logger.error(f"Error during {method_name} for article {article['url']}: {str(e)}")
+                    failed[article['url']] = f"{method_name}: {e}"
+                    clear_gpu_memory()
 
         articles[i:i + batch_size] = batch
         clear_gpu_memory()
@@ -70,6 +84,30 @@ def process_articles_in_batches(text_analysis_class, method_name, articles, batc
     del processor
     clear_gpu_memory()
     logger.info(f"{method_name} processing completed for all articles")
+    return failed
+
+ANALYSIS_STAGES = [(NEExtractor, 'extract_entities'), (TopicExtractor, 'extract_topics'),
+                   (Vectorizer, 'vectorize'), (Summarizer, 'summarize')]
+
+def patch_changed_articles(change_detector, changed_articles, keycloak_login):
+    """Re-run only the stages whose inputs changed and send the results as minimal patch_content diffs."""
+    for text_analysis_class, method_name in ANALYSIS_STAGES:
+        stage_articles = [article for article, changed_fields in changed_articles
+                          if method_name in change_detector.stages_to_rerun(changed_fields)]
+        if stage_articles:
+            logger.info(f"Re-running {method_name} for {len(stage_articles)} changed articles")
+            process_articles_in_batches(text_analysis_class, method_name, stage_articles, 100)
+
+    data_uploader = DataUploader(keycloak_login.get_token())
+    for article, changed_fields in changed_articles:
+        patch = change_detector.build_patch(article, changed_fields)
+        try:
+            data_uploader.patch_content(patch, raise_for_status=True, url=article['url'])
+            # Only a patch the API accepted becomes the new baseline; a failed one is retried on the next re-scrape
+            change_detector.record([article])
+            logger.info(f"Patched fields {sorted(patch)} of changed article: {article['url']}")
+        except Exception as e:
+            logger.error(f"Error patching changed article {article['url']}: {str(e)}", exc_info=True)
 
 
 if __name__ == "__main__":
@@ -83,6 +121,10 @@ if __name__ == "__main__":
         "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="Set the logging level (default: INFO)"
     )
+    parser.add_argument(
+        "--detect-changes", action="store_true",
+        help="Re-scrape articles already in the DB and patch the fields of those whose content changed"
+    )
     args = parser.parse_args()
 
     # Configure logging
@@ -131,8 +173,12 @@ if __name__ == "__main__":
 
         logger.info("Patching last online verification dates for URLs already in DB")
         try:
-            data_uploader.patch_last_online_verification_date(all_urls_already_in_db)
-            logger.info("Successfully patched last online verification dates")
+            outcomes = data_uploader.patch_last_online_verification_date_bulk(all_urls_already_in_db)
+            failed_urls = [url for url, outcome in outcomes.items() if outcome["status"] == "failed"]
+            if failed_urls:
+                logger.warning(f"Could not patch last online verification dates for {len(failed_urls)} URLs: {failed_urls}")
+            else:
+                logger.info("Successfully patched last online verification dates")
         except Exception as e:
             logger.error(f"Error during patching last online verification dates: {str(e)}", exc_info=True)
 
@@ -141,34 +187,69 @@ if __name__ == "__main__":
         articles_list_for_new_scraping = [url for url in all_found_urls if url not in all_urls_already_in_db]
         logger.info(f"Found {len(articles_list_for_new_scraping)} new articles to scrape")
 
+        change_detector = ContentChangeDetector()
+        # The scraper closes the browser after scraping, so known articles are re-scraped in the same call
+        urls_to_scrape = articles_list_for_new_scraping + (all_urls_already_in_db if args.detect_changes else [])
+
+        articles = []
         try:
-            articles = scraper.scrape(articles_list_for_new_scraping)
-            logger.info(f"Successfully scraped {len(articles)} new articles")
+            articles = scraper.scrape(urls_to_scrape)
+            logger.info(f"Successfully scraped {len(articles)} articles")
         except Exception as e:
             logger.error(f"Error during scraping: {str(e)}", exc_info=True)
 
-        process_articles_in_batches(NEExtractor, 'extract_entities', articles, 100)
-        process_articles_in_batches(TopicExtractor, 'extract_topics', articles, 100)
-
-        # Catch CUDA OOM errors specifically during vectorization
-        process_articles_in_batches(Vectorizer, 'vectorize', articles, 100)
-
-        process_articles_in_batches(Summarizer, 'summarize', articles, 100)
+        known_urls = set(all_urls_already_in_db)
+        rescraped_articles = [article for article in articles if article['url'] in known_urls]
+        articles = [article for article in articles if article['url'] not in known_urls]
+
+        if rescraped_articles:
+            changed_articles, _, articles_without_baseline = change_detector.partition(rescraped_articles)
+            # Articles uploaded before change detection existed only get a baseline for the next run
+            change_detector.record(articles_without_baseline)
+            patch_changed_articles(change_detector, changed_articles, keycloak_login)
+
+        # Articles that failed in an earlier run and are due for another attempt
+        retry_store = RetryStore()
+        articles.extend(retry_store.claim_due())
+        # Retries start again from the article as scraped, not from one that earlier stages already extended
+        originals = {article['url']: copy.deepcopy(article) for article in articles}
+
+        for text_analysis_class, method_name in ANALYSIS_STAGES:
+            failed = process_articles_in_batches(text_analysis_class, method_name, articles, 100)
+            for article in articles:
+                if article['url'] in failed:
+                    retry_store.record_failure(originals[article['url']], method_name, failed[article['url']])
+            articles = [article for article in articles if article['url'] not in failed]
+
+        # Spooled articles are guaranteed to be uploaded eventually, so their fingerprints
+        # can be recorded now, while the texts are still there
+        change_detector.record(articles)
 
         for article in articles:
             article.pop('main_text', None)
             article.pop('lead_text', None)
 
+        # Persist the processed articles before uploading, so that a failed upload can be
+        # replayed with drain_spool.py instead of re-running the NLP stages
+        spool = UploadSpool()
+        article_ids = spool.append(articles)
+        logger.info(f"Spooled {len(articles)} processed articles to {spool.path}")
+
         token = keycloak_login.get_token()
         data_uploader = DataUploader(token)
         responses = []
-        for article in articles:
+        for article_id, article in zip(article_ids, articles):
             try:
-                response = data_uploader.post_content(article)
+                response = data_uploader.post_content(article, raise_for_status=True)
+                spool.ack(article_id)
+                retry_store.resolve([article['url']])
                 responses.append(response)
                 logger.info(f"Successfully uploaded article: {article.get('url', 'N/A')}")
             except Exception as e:
-                logger.error(f"Error uploading article {article.get('url', 'N/A')}: {str(e)}", exc_info=True)
+                logger.error(f"Error uploading article {article.get('url', 'N/A')}, kept in spool: {str(e)}", exc_info=True)
+                if not retry_store.record_failure(article, UPLOAD_STAGE, e):
+                    # Out of attempts: the article now lives in the dead letters instead of the spool
+                    spool.ack(article_id)
 
         with open('responses.json', 'w') as f:
             json.dump(responses, f)
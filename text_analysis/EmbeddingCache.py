@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+def normalize_sentence(sentence):
+    """Unicode- and whitespace-normalized form of a sentence, under which it is cached."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", sentence)).strip()
+
+def sentence_key(sentence):
+    return hashlib.blake2b(normalize_sentence(sentence).encode("utf-8"), digest_size=16).hexdigest()
+
+class EmbeddingCache:
+    """Persistent cache of the sentence embeddings of one model, so that repeated sentences (bylines,
+    teasers, newsletter notices, re-scraped lead texts) are looked up instead of encoded again.
+
+    The embeddings are kept in a memory-mapped float32 file with a fixed number of rows, sized to
+    max_bytes; an SQLite index maps the hash of each normalized sentence to its row. Once all rows are
+    taken, the least recently used sentences are overwritten. The directory can be shared by all worker
+    processes on a machine. Use a separate name for every variant of a model whose embeddings differ,
+    e.g. the int8 quantized or ONNX one.
+    """
+
+    def __init__(self, name, path=EMBEDDING_CACHE_SETTINGS["path"], max_bytes=EMBEDDING_CACHE_SETTINGS["max_bytes"]):
+        self.name = name
+        self.directory = os.path.join(path, name.replace("/", "--"))
+        self.max_bytes = max_bytes
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self.metrics = {"lookups": 0, "hits": 0, "encoded": 0, "evicted": 0}
+        os.makedirs(self.directory, exist_ok=True)
+        # The timeout lets concurrent writers of other worker processes wait for the file lock
+        self._connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=30,
+                                           check_same_thread=False, isolation_level=None)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, last_used REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)")
+        settings = dict(self._connection.execute("SELECT name, value FROM settings").fetchall())
+        if settings:
+            self._open(settings["dimension"], settings["capacity"])
+
+    def _open(self, dimension, capacity):
+        path = os.path.join(self.directory, "embeddings.f32")
+        # A new file is created sparse, so it only takes disk space as rows are written
+        mode = "r+" if os.path.exists(path) else "w+"
+        self._embeddings = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, dimension))
+
+    def _initialize(self, dimension):
+        """Size the store for the embedding dimension of the model, on the first embeddings written."""
+        capacity = max(1, self.max_bytes // (4 * dimension))
+        self._connection.execute("INSERT OR IGNORE INTO settings VALUES ('dimension', ?), ('capacity', ?)", (dimension, capacity))
+        settings = dict(self._connection.execute("SELECT name, value FROM settings").fetchall())
+        self._open(settings["dimension"], settings["capacity"])
+
+    def encode(self, model, sentences, batch_size=32):
+        """Return the embeddings of the sentences like model.encode, encoding only the ones not cached."""
+        keys = [sentence_key(sentence) for sentence in sentences]
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            if self._embeddings is not None:
+                self._connection.execute("BEGIN IMMEDIATE")
+                for start in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                    for key, slot in rows:
+                        found[key] = np.array(self._embeddings[slot])
+                now = time.time()
+                self._connection.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._connection.execute("COMMIT")
+
+        # Duplicates within the call are encoded once
+        missing = {}
+        for key, sentence in zip(keys, sentences):
+            if key not in found:
+                missing.setdefault(key, sentence)
+        if missing:
+            encoded = np.asarray(model.encode(list(missing.values()), batch_size=batch_size), dtype=np.float32)
+            found.update(zip(missing, encoded))
+            self._store(dict(zip(missing, encoded)))
+
+        self.metrics["lookups"] += len(sentences)
+        self.metrics["hits"] += sum(key not in missing for key in keys)
+        self.metrics["encoded"] += len(missing)
+        if not sentences:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def _store(self, embeddings):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self._embeddings is None:
+                    self._initialize(len(next(iter(embeddings.values()))))
+                capacity = self._embeddings.shape[0]
+                # Another process may have stored some of them in the meantime
+                keys = [key for key in embeddings
+                        if not self._connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()][:capacity]
+                used = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                slots = list(range(used, min(capacity, used + len(keys))))
+                if len(slots) < len(keys):
+                    # Overwrite the rows of the least recently used sentences
+                    evicted = self._connection.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                                                       (len(keys) - len(slots),)).fetchall()
+                    self._connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    slots += [slot for _, slot in evicted]
+                    self.metrics["evicted"] += len(evicted)
+                for key, slot in zip(keys, slots):
+                    self._embeddings[slot] = embeddings[key]
+                self._embeddings.flush()
+                self._connection.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                                             [(key, slot, now) for key, slot in zip(keys, slots)])
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        lookups = self.metrics["lookups"]
+        return {**self.metrics, "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"Embedding cache {self.name}: {stats['hits']} of {stats['lookups']} sentences cached "
+                    f"({stats['hit_rate']:.1%}), {stats['encoded']} encoded, {stats['evicted']} evicted")
+
+    def close(self):
+        if self._embeddings is not None:
+            self._embeddings.flush()
+        self._connection.close()
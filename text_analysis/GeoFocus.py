@@ -0,0 +1,189 @@
+import logging
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+import yaml
+from babel import Locale
+
+from config import GEO_FOCUS_SETTINGS
+
+# Snowball German stopwords, the list quanteda's stopwords("german") returns
+GERMAN_STOPWORDS = set("""
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes anderm andern anderr
+anders auch auf aus bei bin bis bist da damit dann der den des dem die das daß derselbe derselben denselben desselben
+demselben dieselbe dieselben dasselbe dazu dein deine deinem deinen deiner deines denn derer dessen dich dir du dies
+diese diesem diesen dieser dieses doch dort durch ein eine einem einen einer eines einig einige einigem einigen
+einiger einiges einmal er ihn ihm es etwas euer eure eurem euren eurer eures für gegen gewesen hab habe haben hat
+hatte hatten hier hin hinter ich mich mir ihr ihre ihrem ihren ihrer ihres euch im in indem ins ist jede jedem jeden
+jeder jedes jene jenem jenen jener jenes jetzt kann kein keine keinem keinen keiner keines können könnte machen man
+manche manchem manchen mancher manches mein meine meinem meinen meiner meines mit muss musste nach nicht nichts noch
+nun nur ob oder ohne sehr sein seine seinem seinen seiner seines selbst sich sie ihnen sind so solche solchem
+solchen solcher solches soll sollte sondern sonst über um und uns unsere unserem unseren unser unseres unter viel
+vom von vor während war waren warst was weg weil weiter welche welchem welchen welcher welches wenn werde werden wie
+wieder will wir wird wirst wo wollen wollte würde würden zu zum zur zwar zwischen
+""".split())
+
+# Words without digits, hyphenated compounds kept together, like quanteda's tokens() with
+# remove_punct, remove_numbers and remove_symbols
+TOKEN_PATTERN = re.compile(r"[^\W\d_]\w*(?:[-'’]\w+)*|\d\w*")
+# Candidate features: capitalized words, as selected in infer_geo_focus.R
+FEATURE_PATTERN = re.compile(r"^[A-ZÄÖÜ][A-Za-zäöüß1-2]+")
+
+class GeoFocusInferrer:
+    """Infers the geographical focus of articles in process, with the semi-supervised newsmap model
+    (Watanabe 2018) that text_analysis/infer_geo_focus.R fits with the newsmap R package.
+
+    Country names from the newsmap dictionary label the articles that mention them; a model trained
+    on those labels scores the capitalized words of every article, so that articles are also assigned
+    through place and people names the dictionary does not know. As in the R script, the model is fit
+    on the batch itself and predicts the batch, so larger batches give better estimates.
+    """
+
+    def __init__(self, dictionary_path=GEO_FOCUS_SETTINGS["dictionary_path"], min_termfreq=GEO_FOCUS_SETTINGS["min_termfreq"],
+                 smooth=GEO_FOCUS_SETTINGS["smooth"]):
+        self.logger = logging.getLogger(__name__)
+        self.min_termfreq = min_termfreq
+        self.smooth = smooth
+        self.country_names = Locale("en").territories
+        self._load_dictionary(dictionary_path)
+
+    def _load_dictionary(self, path):
+        """Load a newsmap dictionary in quanteda's YAML format (region > subregion > country code > patterns).
+        The file is part of the deployment; workers never download it."""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"newsmap dictionary {path} is missing; fetch it once with "
+                                    f"'python validate_geo_focus.py --fetch-dictionary' and commit it")
+        with open(path, encoding="utf-8") as f:
+            dictionary = yaml.safe_load(f)
+
+        patterns = defaultdict(list)
+
+        def collect(node, level, key):
+            if isinstance(node, dict):
+                for child_key, child in node.items():
+                    collect(child, level + 1, str(child_key) if level + 1 == 3 else key)
+            elif key is not None:
+                patterns[key].extend(node if isinstance(node, list) else [node])
+
+        collect(dictionary, 0, None)
+        self.keys = list(patterns)
+        # Split the glob patterns by how they can be matched fastest: exact words, word prefixes
+        # ("berlin*"), other globs as regular expressions, and multi-word phrases by their first word
+        self._exact = defaultdict(set)
+        self._prefixes = defaultdict(set)
+        self._globs = []
+        self._phrases = defaultdict(list)
+        for index, key in enumerate(self.keys):
+            for pattern in patterns[key]:
+                words = str(pattern).lower().split()
+                if len(words) > 1:
+                    self._phrases[len(words)].append((tuple(self._compile_glob(word) for word in words), index))
+                elif "?" not in words[0] and "*" not in words[0][:-1]:
+                    if words[0].endswith("*"):
+                        self._prefixes[words[0][:-1]].add(index)
+                    else:
+                        self._exact[words[0]].add(index)
+                else:
+                    self._globs.append((self._compile_glob(words[0]), index))
+        self._word_keys = {}
+        self.logger.info("Loaded newsmap dictionary with %d countries", len(self.keys))
+
+    @staticmethod
+    def _compile_glob(pattern):
+        return re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern) + r"\Z")
+
+    def _keys_of_word(self, word):
+        """Return the indices of the countries whose single-word patterns match a lowercased word."""
+        if word not in self._word_keys:
+            keys = set(self._exact.get(word, ()))
+            for end in range(1, len(word) + 1):
+                keys.update(self._prefixes.get(word[:end], ()))
+            keys.update(index for regex, index in self._globs if regex.match(word))
+            self._word_keys[word] = keys
+        return self._word_keys[word]
+
+    @staticmethod
+    def tokenize(text):
+        """Tokenize like the R script: numbers dropped, stopwords replaced by padding (None),
+        so that neither dictionary phrases nor features span a removed stopword."""
+        tokens = []
+        for token in TOKEN_PATTERN.findall(text or ""):
+            if token[0].isdigit():
+                continue
+            tokens.append(None if token.lower() in GERMAN_STOPWORDS else token)
+        return tokens
+
+    def _lookup(self, tokens):
+        """Count the dictionary matches per country in a tokenized text. Like quanteda's tokens_lookup
+        with nested_scope="key", overlapping matches of the same country count once."""
+        lowered = [token.lower() if token is not None else None for token in tokens]
+        spans = defaultdict(list)
+        for position, word in enumerate(lowered):
+            if word is None:
+                continue
+            for index in self._keys_of_word(word):
+                spans[index].append((position, position + 1))
+            for length, phrases in self._phrases.items():
+                window = lowered[position:position + length]
+                if len(window) < length or None in window:
+                    continue
+                for regexes, index in phrases:
+                    if all(regex.match(w) for regex, w in zip(regexes, window)):
+                        spans[index].append((position, position + length))
+        counts = {}
+        for index, key_spans in spans.items():
+            count, covered_until = 0, -1
+            # Longest match first at every position, then skip everything it covers
+            for start, end in sorted(key_spans, key=lambda span: (span[0], -span[1])):
+                if start >= covered_until:
+                    count += 1
+                    covered_until = end
+            counts[index] = count
+        return counts
+
+    def infer(self, texts):
+        """Return the English name of the country in focus of every text, or None where it cannot be inferred."""
+        tokenized = [self.tokenize(text) for text in texts]
+
+        # Label matrix: dictionary matches per text and country
+        labels = np.zeros((len(texts), len(self.keys)))
+        for row, tokens in enumerate(tokenized):
+            for index, count in self._lookup(tokens).items():
+                labels[row, index] = count
+
+        # Feature matrix: capitalized words that occur at least min_termfreq times in the batch
+        vocabulary = {}
+        rows, columns = [], []
+        for row, tokens in enumerate(tokenized):
+            for token in tokens:
+                if token is not None and FEATURE_PATTERN.match(token):
+                    rows.append(row)
+                    columns.append(vocabulary.setdefault(token, len(vocabulary)))
+        features = np.zeros((len(texts), len(vocabulary)))
+        np.add.at(features, (rows, columns), 1)
+        features = features[:, features.sum(axis=0) >= self.min_termfreq]
+
+        # Countries that label no text are dropped, as with drop_label = TRUE
+        labelled = labels.sum(axis=0) > 0
+        if not labelled.any() or not features.size:
+            self.logger.info("Not enough dictionary matches or features to infer a geographical focus")
+            return [None] * len(texts)
+        keys = [key for key, keep in zip(self.keys, labelled) if keep]
+        in_class = (labels[:, labelled] > 0).astype(float)
+
+        # Association of every feature with every country: log ratio of its smoothed relative frequency
+        # in the texts labelled with the country and in all other texts
+        totals = features.sum(axis=0)
+        class_counts = in_class.T @ features
+        inside = class_counts + self.smooth
+        outside = totals - class_counts + self.smooth
+        model = np.log(inside / inside.sum(axis=1, keepdims=True)) - np.log(outside / outside.sum(axis=1, keepdims=True))
+
+        # Score the relative feature frequencies of every text; texts without features stay unassigned
+        lengths = features.sum(axis=1, keepdims=True)
+        scores = (features / np.where(lengths > 0, lengths, 1)) @ model.T
+        best = scores.argmax(axis=1)
+        return [self.country_names.get(keys[best[row]].upper()) if lengths[row, 0] > 0 else None
+                for row in range(len(texts))]
@@ -1,22 +1,30 @@
 import torch
 import gc
-from flair.data import Sentence
 from flair.models import SequenceTagger
-from datasets import Dataset
+from flair.splitter import SegtokSentenceSplitter
 import logging
-import subprocess
-import os
+from text_analysis.GeoFocus import GeoFocusInferrer
+from text_analysis.Quantization import load_quantized
+from config import CPU_INFERENCE_SETTINGS
 
 class NEExtractor:
-    """A named entity extractor that uses the Flair library to extract named entities from text and newsmap to infer geographical focus."""
+    """A named entity extractor that uses the Flair library to extract named entities from text and a newsmap model to infer geographical focus."""
     
-    def __init__(self, model="flair/ner-german-large", max_chunk_size=5000):
-        """Initialize the named entity extractor with a specific flair model and chunk size."""
+    def __init__(self, model="flair/ner-german-large", max_chunk_size=5000, mini_batch_size=32, quantize=CPU_INFERENCE_SETTINGS["quantize"]):
+        """Initialize the named entity extractor with a specific flair model, chunk size and the number
+        of sentences the tagger processes at once."""
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing NEExtractor with model: %s", model)
+        self.max_chunk_size = max_chunk_size
+        self.mini_batch_size = mini_batch_size
+        self.splitter = SegtokSentenceSplitter()
+        self.geo_focus = GeoFocusInferrer()
         try:
-            self.tagger = SequenceTagger.load(model)
-            self.max_chunk_size = max_chunk_size
+            if quantize:
+                # CPU profile: int8 quantized model
+                self.tagger = load_quantized(model, lambda: SequenceTagger.load(model))
+            else:
+                self.tagger = SequenceTagger.load(model)
             self.logger.info('Tagger instantiated successfully')
         except Exception as e:
             self.logger.error("Failed to load model '%s'. Error: %s", model, e)
@@ -32,65 +40,49 @@ class NEExtractor:
             chunks = [text]  # If text is not too long, return it as a single chunk
         return chunks
     
+    def split_sentences(self, text):
+        """Split a text into flair sentences. Texts are chunked first, so that even a text without
+        sentence boundaries never yields a sentence longer than max_chunk_size tokens."""
+        sentences = []
+        for chunk in self.chunk_text(text, self.max_chunk_size):
+            sentences.extend(self.splitter.split(chunk))
+        return sentences
+
     def extract_entities(self, articles_list):
         """
         Extract unique entities for each entry in the articles list and add them to the dataset.
-        Also infer geographical focus using the newsmap R package.
+        Also infer geographical focus with a newsmap model.
         """
         self.logger.info("Starting entity extraction for %d articles", len(articles_list))
-        
-        # Convert articles_list to a Hugging Face Dataset
-        dataset = Dataset.from_dict({"main_text": [article["main_text"] for article in articles_list]})
 
-        # Define a function to extract entities
-        def extract(example):
-            entity_dict = {}
+        # Split all articles of the batch into sentences, remembering which article each belongs to
+        sentences_per_article = [self.split_sentences(article["main_text"] or "") for article in articles_list]
+        all_sentences = [sentence for sentences in sentences_per_article for sentence in sentences]
+        self.logger.info("Tagging %d sentences of %d articles", len(all_sentences), len(articles_list))
 
-            # Chunk the text only if it's too long
-            chunks = self.chunk_text(example["main_text"], self.max_chunk_size)
+        # One predict call for the whole batch; sorted by length, the mini-batches need little padding
+        with torch.no_grad():
+            self.tagger.predict(sorted(all_sentences, key=len, reverse=True), mini_batch_size=self.mini_batch_size)
 
-            # Process each chunk individually
-            for i, chunk in enumerate(chunks):
-                self.logger.debug("Processing chunk %d of %d", i+1, len(chunks))
-                sentence = Sentence(chunk)
-                
-                # Perform entity prediction within a no_grad context
-                with torch.no_grad():
-                    self.tagger.predict(sentence)
-                
-                # Collect entities from the sentence
+        # Map the entities back to their articles, in the order of their sentences
+        for single_article_dict, sentences in zip(articles_list, sentences_per_article):
+            entity_dict = {}
+            for sentence in sentences:
                 for entity in sentence.get_spans('ner'):
                     if entity.text not in entity_dict or entity_dict[entity.text] != entity.tag:
                         entity_dict[entity.text] = entity.tag
-                
-                # Clear the sentence from memory after processing
-                del sentence
-                gc.collect()
-                torch.cuda.empty_cache()
 
             # Prepare the central_entities format
-            entities = list(entity_dict.keys())
-            entity_types = list(entity_dict.values())
-            entity_types = [entity_type.lower() for entity_type in entity_types]
-            central_entities = [{"type_id": type_id, "title": entity} for entity, type_id in zip(entities, entity_types)]
-            
-            self.logger.debug("Extracted %d unique entities", len(central_entities))
-            return {"central_entities": central_entities}
-
-        # Apply the extraction to the entire dataset
-        self.logger.info("Applying entity extraction to all articles")
-        results = dataset.map(extract, batched=False)
-
-        # Update the original articles with the extracted entities
-        for i, single_article_dict in enumerate(articles_list):
-            single_article_dict["central_entities"] = results[i]["central_entities"]
+            single_article_dict["central_entities"] = [{"type_id": entity_type.lower(), "title": entity}
+                                                       for entity, entity_type in entity_dict.items()]
+            self.logger.debug("Extracted %d unique entities", len(entity_dict))
 
         # Infer geographical focus using newsmap
         self.logger.info("Inferring geographical focus")
         articles_list = self._infer_geo_focus(articles_list)
 
-        # Final GPU memory cleanup
-        del results
+        # GPU memory cleanup, once per batch
+        del sentences_per_article, all_sentences
         torch.cuda.empty_cache()
         gc.collect()
 
@@ -99,43 +91,21 @@ class NEExtractor:
 
 
     def _infer_geo_focus(self, articles_list):
-        """Infer geographical focus of the articles using the newsmap R package."""
+        """Infer geographical focus of the articles in process with a newsmap model fit on the batch."""
         self.logger.info("Starting geographical focus inference for %d articles", len(articles_list))
-        # delete the files if they exist
-        if os.path.exists('main_texts_for_geo_focus_inference.txt'):
-            os.remove('main_texts_for_geo_focus_inference.txt')
-        if os.path.exists('geo_inference_country_names.txt'):
-            os.remove('geo_inference_country_names.txt')
-
         try:
-            # Write main_text to file
-            input_file_path = 'main_texts_for_geo_focus_inference.txt'
-            with open(input_file_path, 'w', encoding='utf-8') as f:
-                for article in articles_list:
-                    f.write(article['main_text'] + '\n')
-            
-            self.logger.debug("Wrote main texts to file: %s", input_file_path)
+            country_names = self.geo_focus.infer([article['main_text'] for article in articles_list])
 
-            # Call R script
-            r_script_path = os.path.join('text_analysis', 'infer_geo_focus.R')
-            self.logger.debug("Calling R script: %s", r_script_path)
-            subprocess.run(['Rscript', r_script_path], check=True)
-            
-            # Read the output file
-            output_file_path = 'geo_inference_country_names.txt'
-            with open(output_file_path, 'r', encoding='utf-8') as f:
-                country_names = f.read().strip().split('\n')
-            
             # Add inferred geographical focus to the original articles
             for i, (article, country) in enumerate(zip(articles_list, country_names)):
-                if country and country != 'NA':
+                if country:
                     article['central_entities'].append({"title": country, "type_id": "loc"})
                     self.logger.debug("Added geographical focus '%s' to article %d", country, i)
                 else:
                     self.logger.debug("No geographical focus inferred for article %d", i)
-            
+
             self.logger.info("Geographical focus inference completed successfully")
         except Exception as e:
             self.logger.error("Error in geographical focus inference: %s", str(e))
-        
+
         return articles_list
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+from config import ONNX_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Sentences to check the exported graph against the PyTorch model
+PROBE_SENTENCES = [
+    "Der Bundestag hat den Haushalt für das kommende Jahr beschlossen.",
+    "Kurz.",
+    "Die Inflationsrate ist im Oktober gesunken, wie das Statistische Bundesamt in Wiesbaden mitteilte, "
+    "vor allem Energie war günstiger als vor einem Jahr.",
+]
+
+class OnnxSentenceEncoder:
+    """Runs a sentence-transformers model through ONNX Runtime, with the encode() interface of SentenceTransformer.
+
+    On first use the transformer is exported to ONNX, together with its tokenizer and pooling settings,
+    into <cache_dir>/onnx/<model>; the export is checked against the PyTorch model on probe sentences.
+    Later runs load the export without PyTorch. Pooling and normalization are done in numpy.
+    A failed or rejected export is remembered in rejected.json, so that it is not tried again on every
+    start; delete the export directory to try again.
+    """
+
+    def __init__(self, model_name, cache_dir="transformers_cache_dir", tolerance=ONNX_SETTINGS["tolerance"]):
+        self.model_name = model_name
+        self.export_dir = os.path.join(cache_dir, "onnx", model_name.replace("/", "--"))
+        rejected_path = os.path.join(self.export_dir, "rejected.json")
+        if os.path.exists(rejected_path):
+            with open(rejected_path) as f:
+                raise ValueError(f"ONNX export of {model_name} was rejected before ({json.load(f)['error']}), "
+                                 f"delete {self.export_dir} to export again")
+        if not os.path.exists(os.path.join(self.export_dir, "settings.json")):
+            try:
+                self._export(model_name, cache_dir, tolerance)
+            except Exception as e:
+                # Drop the partial export and remember the failure
+                shutil.rmtree(self.export_dir, ignore_errors=True)
+                os.makedirs(self.export_dir, exist_ok=True)
+                with open(rejected_path, "w") as f:
+                    json.dump({"error": str(e)}, f)
+                raise
+        with open(os.path.join(self.export_dir, "settings.json")) as f:
+            self.settings = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.export_dir)
+        self.session = self._create_session(os.path.join(self.export_dir, "model.onnx"))
+
+    @staticmethod
+    def _create_session(path):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_SETTINGS["intra_op_num_threads"]:
+            options.intra_op_num_threads = ONNX_SETTINGS["intra_op_num_threads"]
+        return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def _export(self, model_name, cache_dir, tolerance):
+        # PyTorch is only needed for the export
+        import torch
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling
+
+        logger.info(f"Exporting {model_name} to ONNX in {self.export_dir}")
+        model = SentenceTransformer(model_name, cache_folder=cache_dir, device="cpu")
+        model.eval()
+        transformer = model[0].auto_model
+        pooling = next(module for module in model if isinstance(module, Pooling))
+        tokenizer = model.tokenizer
+        inputs = tokenizer(PROBE_SENTENCES, padding=True, truncation=True, max_length=model.max_seq_length, return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+
+        os.makedirs(self.export_dir, exist_ok=True)
+        temporary_path = os.path.join(self.export_dir, f"model.onnx.{os.getpid()}.tmp")
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(inputs[name] for name in input_names),
+                temporary_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                              "last_hidden_state": {0: "batch", 1: "sequence"}},
+                opset_version=ONNX_SETTINGS["opset_version"],
+            )
+        os.replace(temporary_path, os.path.join(self.export_dir, "model.onnx"))
+        tokenizer.save_pretrained(self.export_dir)
+        self.settings = {
+            "input_names": input_names,
+            "max_seq_length": model.max_seq_length,
+            "pooling_mode": "cls" if pooling.pooling_mode_cls_token else "max" if pooling.pooling_mode_max_tokens else "mean",
+            "normalize": any(isinstance(module, Normalize) for module in model),
+        }
+
+        # The export only counts as done once it reproduces the PyTorch embeddings
+        self.tokenizer = tokenizer
+        self.session = self._create_session(os.path.join(self.export_dir, "model.onnx"))
+        expected = model.encode(PROBE_SENTENCES, convert_to_numpy=True)
+        difference = float(np.abs(self.encode(PROBE_SENTENCES) - expected).max())
+        if difference > tolerance:
+            raise ValueError(f"ONNX export of {model_name} differs from PyTorch by {difference:.2e}, more than {tolerance:.0e}")
+        with open(os.path.join(self.export_dir, "settings.json"), "w") as f:
+            json.dump(self.settings, f)
+        logger.info(f"Exported {model_name} to ONNX, maximum difference to PyTorch {difference:.2e}")
+
+    def _pool(self, hidden_states, attention_mask):
+        mask = attention_mask[..., None].astype(np.float32)
+        if self.settings["pooling_mode"] == "cls":
+            embeddings = hidden_states[:, 0]
+        elif self.settings["pooling_mode"] == "max":
+            embeddings = np.where(mask > 0, hidden_states, -1e9).max(axis=1)
+        else:
+            embeddings = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.settings["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """Return the pooled embeddings of the sentences as a float32 array, like SentenceTransformer.encode."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        # Length-sorted batches need the least padding; the original order is restored afterwards
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            indices = order[start:start + batch_size]
+            inputs = self.tokenizer([sentences[i] for i in indices], padding=True, truncation=True,
+                                    max_length=self.settings["max_seq_length"], return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.settings["input_names"]}
+            hidden_states = self.session.run(["last_hidden_state"], feed)[0]
+            for i, embedding in zip(indices, self._pool(hidden_states, inputs["attention_mask"])):
+                embeddings[i] = embedding
+        embeddings = np.stack(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
@@ -0,0 +1,41 @@
+import logging
+import os
+
+import torch
+
+from config import CPU_INFERENCE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+def _cache_path(model_name, cache_dir):
+    # Pickled quantized modules are tied to the torch version that wrote them
+    return os.path.join(cache_dir, f"{model_name.replace('/', '--')}.int8.torch-{torch.__version__}.pt")
+
+def load_quantized(model_name, load_model, cache_dir=CPU_INFERENCE_SETTINGS["cache_dir"]):
+    """Return the int8 dynamically quantized version of a model for CPU inference.
+
+    The linear layers, which dominate the compute of transformer models, get int8 weights and are
+    computed with dynamically quantized activations. The quantized module is cached on disk, so later
+    runs neither load the full-precision weights nor quantize again; load_model is only called on a miss.
+    """
+    if CPU_INFERENCE_SETTINGS["num_threads"]:
+        torch.set_num_threads(CPU_INFERENCE_SETTINGS["num_threads"])
+    path = _cache_path(model_name, cache_dir)
+    if os.path.exists(path):
+        try:
+            model = torch.load(path, map_location="cpu", weights_only=False)
+            logger.info(f"Loaded quantized {model_name} from {path}")
+            return model
+        except Exception as e:
+            logger.warning(f"Could not load quantized {model_name} from {path}, quantizing again: {e}")
+
+    model = load_model()
+    model.to("cpu")
+    model.eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(model, temporary_path)
+    os.replace(temporary_path, path)
+    logger.info(f"Quantized {model_name} and cached it in {path}")
+    return model
@@ -6,8 +6,10 @@ import gc
 from nltk import ngrams
 from typing import List, Dict
 from functools import lru_cache
-from transformers import pipeline
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
 import logging
+from text_analysis.Quantization import load_quantized
+from config import CPU_INFERENCE_SETTINGS
 
 # bartowski/Llama-3.1-SauerkrautLM-8b-Instruct-GGUF
 # Llama-3.1-SauerkrautLM-8b-Instruct-Q6_K_L.gguf
@@ -24,20 +26,26 @@ class Summarizer:
                  context_length: int = 8192,
                  batch_size: int = 16,
                  fast_mode: bool = True,
-                 fast_mode_model: str = "google/flan-t5-large"):
+                 fast_mode_model: str = "google/flan-t5-large",
+                 quantize: bool = CPU_INFERENCE_SETTINGS["quantize"]):
         self.max_new_tokens = max_new_tokens
         self.context_length = context_length
         self.batch_size = batch_size
         self.fast_mode = fast_mode
 
-        if fast_mode:
+        if fast_mode and quantize:
+            # CPU profile: int8 quantized model
+            model = load_quantized(fast_mode_model, lambda: AutoModelForSeq2SeqLM.from_pretrained(fast_mode_model))
+            self.summarizer = pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(fast_mode_model), device=-1)
+        elif fast_mode:
             self.summarizer = pipeline("summarization", model=fast_mode_model, device=0 if torch.cuda.is_available() else -1)
         else:
+            # The GGUF model is quantized already; the CPU profile only keeps all layers on the CPU
             llm = AutoModelForCausalLM.from_pretrained(
                 model_path,
                 model_file=model_file,
                 model_type="mistral",
-                gpu_layers=32,  # Set to 0 for CPU-only, adjust if GPU is available
+                gpu_layers=0 if quantize else 32,  # Set to 0 for CPU-only, adjust if GPU is available
                 context_length=context_length,
                 threads=8  # Utilize multiple CPU threads
             )
@@ -1,12 +1,19 @@
 import torch
-from transformers import AutoTokenizer, pipeline
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
 from datasets import Dataset
+from text_analysis.Quantization import load_quantized
+from config import CPU_INFERENCE_SETTINGS
 
 class TopicExtractor:
-    def __init__(self, model_name="MoritzLaurer/bge-m3-zeroshot-v2.0"):
+    def __init__(self, model_name="MoritzLaurer/bge-m3-zeroshot-v2.0", quantize=CPU_INFERENCE_SETTINGS["quantize"]):
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        device = 0 if torch.cuda.is_available() else -1  # Use GPU if available
-        self.classifier = pipeline("zero-shot-classification", model=model_name, device=device)
+        if quantize:
+            # CPU profile: int8 quantized model
+            model = load_quantized(model_name, lambda: AutoModelForSequenceClassification.from_pretrained(model_name))
+            self.classifier = pipeline("zero-shot-classification", model=model, tokenizer=self.tokenizer, device=-1)
+        else:
+            device = 0 if torch.cuda.is_available() else -1  # Use GPU if available
+            self.classifier = pipeline("zero-shot-classification", model=model_name, device=device)
 
     def extract_topics(self, articles_list):
         topics = [
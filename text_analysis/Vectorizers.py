@@ -1,10 +1,15 @@
 import torch
 import gc
+import logging
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import nltk
-from datasets import Dataset
-from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION
+from text_analysis.Quantization import load_quantized
+from text_analysis.EmbeddingCache import EmbeddingCache
+from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION, CPU_INFERENCE_SETTINGS, VECTORIZATION_BACKENDS, \
+    EMBEDDING_CACHE_SETTINGS
+
+logger = logging.getLogger(__name__)
 
 # TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION = {
 #     'bert': 'deepset/gbert-base', 
@@ -18,58 +23,78 @@ from config import TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION
 class Vectorizer:
     """A vectorizer that uses various Sentence Transformers models to vectorize text."""
     
-    def __init__(self, model_names_dict=TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION, cache_dir="transformers_cache_dir"):
-        self.models = {key: SentenceTransformer(model, cache_folder=cache_dir) for key, model in model_names_dict.items()}
+    def __init__(self, model_names_dict=TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION, cache_dir="transformers_cache_dir",
+                 quantize=CPU_INFERENCE_SETTINGS["quantize"], backends=VECTORIZATION_BACKENDS, batch_size=32,
+                 embedding_cache=EMBEDDING_CACHE_SETTINGS["enabled"]):
+        self.batch_size = batch_size
+        self.models = {key: self._load_model(model, cache_dir, quantize, backends.get(key, "torch"))
+                       for key, model in model_names_dict.items()}
+        self.embedding_caches = {}
+        if embedding_cache:
+            # Quantized and ONNX models give slightly different embeddings, so they are cached separately
+            for key, model in model_names_dict.items():
+                # The backend that was actually loaded counts, a failed ONNX export falls back to torch
+                onnx = type(self.models[key]).__name__ == "OnnxSentenceEncoder"
+                variant = ".onnx" if onnx else ".int8" if quantize else ""
+                self.embedding_caches[key] = EmbeddingCache(model + variant)
+
+    @staticmethod
+    def _load_model(model_name, cache_dir, quantize, backend):
+        if backend == "onnx":
+            try:
+                # Imported here so onnxruntime is only needed when a model uses it
+                from text_analysis.OnnxSentenceEncoder import OnnxSentenceEncoder
+                return OnnxSentenceEncoder(model_name, cache_dir=cache_dir)
+            except Exception as e:
+                logger.warning(f"Falling back to the torch backend for {model_name}, the ONNX backend is not usable: {e}")
+                backend = "torch"
+        if backend != "torch":
+            raise ValueError(f"Unknown vectorization backend {backend!r} for {model_name}")
+        if quantize:
+            # CPU profile: int8 quantized models
+            return load_quantized(model_name, lambda: SentenceTransformer(model_name, cache_folder=cache_dir, device="cpu"))
+        return SentenceTransformer(model_name, cache_folder=cache_dir)
         
     def vectorize(self, articles_list):
-        # Convert articles_list to a Dataset
-        dataset = Dataset.from_dict({
-            "lead_text": [article.get("lead_text", "") for article in articles_list],
-            "main_text": [article.get("main_text", "") for article in articles_list]
-        })
-        
-        # Define a function to apply the vectorization
-        def vectorize_example(example):
-            for key, model in self.models.items():
-                with torch.no_grad():  # Use no_grad to reduce memory usage
-                    lead_sentences = nltk.sent_tokenize(example["lead_text"]) if example["lead_text"] else []
-                    main_sentences = nltk.sent_tokenize(example["main_text"]) if example["main_text"] else []
-
-                    # Generate an embedding for each sentence
-                    if lead_sentences:
-                        lead_sentence_embeddings = model.encode(lead_sentences)
-                        lead_document_embedding = np.mean(lead_sentence_embeddings, axis=0).tolist()
-                    else:
-                        lead_sentence_embeddings = [] # Return empty list if no lead sentences
-                        lead_document_embedding = []  # Return empty list if no lead sentences
-
-                    if main_sentences:
-                        main_sentence_embeddings = model.encode(main_sentences)
-                        main_document_embedding = np.mean(main_sentence_embeddings, axis=0).tolist()
-                    else:
-                        main_document_embedding = [] # Return empty list if no main sentences
-                        main_document_embedding = []  # Return empty list if no main sentences
+        # Segment every text once; all models encode the same sentences
+        segments = [nltk.sent_tokenize(article.get(field) or "") if article.get(field) else []
+                    for article in articles_list for field in ("lead_text", "main_text")]
+        sentences = [sentence for segment in segments for sentence in segment]
+        counts = np.array([len(segment) for segment in segments])
+        offsets = np.cumsum(counts) - counts
 
-                    # Store the embeddings back into the example dictionary
-                    example[f"lead_{key}"] = lead_document_embedding
-                    example[f"full_{key}"] = main_document_embedding
+        for key, model in self.models.items():
+            # One encode call per model over the whole batch; SentenceTransformer and OnnxSentenceEncoder
+            # both sort the sentences by length internally, so the forward passes are full, evenly padded batches
+            with torch.no_grad():  # Use no_grad to reduce memory usage
+                if not sentences:
+                    embeddings = None
+                elif key in self.embedding_caches:
+                    embeddings = self.embedding_caches[key].encode(model, sentences, batch_size=self.batch_size)
+                    self.embedding_caches[key].log_stats()
+                else:
+                    embeddings = model.encode(sentences, batch_size=self.batch_size)
+            document_embeddings = self._segment_means(embeddings, offsets, counts)
 
-                # Explicitly delete the embeddings to free memory
-                del lead_sentence_embeddings, main_sentence_embeddings, lead_document_embedding, main_document_embedding
+            for i, single_article_dict in enumerate(articles_list):
+                single_article_dict[f"lead_{key}"] = document_embeddings[2 * i]
+                single_article_dict[f"full_{key}"] = document_embeddings[2 * i + 1]
 
-            return example
-
-        # Apply the vectorization function to the dataset
-        vectorized_dataset = dataset.map(vectorize_example, batched=False)
-
-        # Convert the results back to a list of dictionaries
-        for i, single_article_dict in enumerate(articles_list):
-            for key in TRANSFORMER_MODEL_NAMES_DICT_VECTORIZATION.keys():
-                single_article_dict[f"lead_{key}"] = vectorized_dataset[i][f"lead_{key}"]
-                single_article_dict[f"full_{key}"] = vectorized_dataset[i][f"full_{key}"]
-
-            # Optionally clear GPU memory and force garbage collection after processing each article
+            # Free the sentence embeddings of this model before running the next one
+            del embeddings, document_embeddings
             torch.cuda.empty_cache()
             gc.collect()
 
         return articles_list
+
+    @staticmethod
+    def _segment_means(embeddings, offsets, counts):
+        """Average the rows of each segment [offset, offset + count); empty segments give an empty list."""
+        means = [[] for _ in counts]
+        nonempty = np.flatnonzero(counts)
+        if len(nonempty):
+            # reduceat sums up to the next given offset, so only the offsets of non-empty segments are passed
+            sums = np.add.reduceat(np.asarray(embeddings, dtype=np.float64), offsets[nonempty], axis=0)
+            for index, document_embedding in zip(nonempty, sums / counts[nonempty, None]):
+                means[index] = document_embedding.astype(np.float32).tolist()
+        return means
@@ -1,7 +1,12 @@
+import argparse
 import json
 import logging
 from database_handling.DataUpload import DataUploader
 from database_handling.KeycloakLogin import KeycloakLogin
+from database_handling.UploadSpool import UploadSpool
+from database_handling.RetryStore import RetryStore, UPLOAD_STAGE
+from kafka_queue.queue_factory import create_queue
+from config import KAFKA_CONSUMER_SETTINGS, PIPELINE_TOPICS
 # configure logging
 def configure_logging(log_level):
     logging.basicConfig(
@@ -48,6 +53,54 @@ def upload_data():
     except Exception as e:
         logger.error(f"Error during upload: {str(e)}")
 
+def upload_from_queue(max_records=KAFKA_CONSUMER_SETTINGS["max_records"], max_wait_ms=KAFKA_CONSUMER_SETTINGS["max_wait_ms"]):
+    """Upload the records of the processed topic, written by process_data.py or the merge stage of process_stage.py.
+    Every batch is spooled before its offsets are committed, so failed uploads are replayed by drain_spool.py."""
+    logger = logging.getLogger(__name__)
+    kafka_queue = create_queue(processed_topic=PIPELINE_TOPICS["output"], manual_commit=True)
+    spool = UploadSpool()
+    retry_store = RetryStore()
+    keycloak_login = KeycloakLogin()
+    logger.info(f"Uploading processed records from {kafka_queue.processed_topic}")
+
+    try:
+        while True:
+            kafka_queue.commit_processed()
+            batch, offsets = kafka_queue.dequeue_processed_batch(max_records, max_wait_ms, with_offsets=True)
+            if not batch:
+                continue
+            # A message is either a single article or a list of articles
+            articles = [article for message in batch for article in (message if isinstance(message, list) else [message])]
+            article_ids = spool.append(articles)
+            kafka_queue.mark_processed(offsets)
+
+            data_uploader = DataUploader(keycloak_login.get_token())
+            for article_id, article in zip(article_ids, articles):
+                try:
+                    data_uploader.post_content(article, raise_for_status=True)
+                    spool.ack(article_id)
+                    retry_store.resolve([article['url']])
+                    logger.info(f"Successfully uploaded article: {article.get('url', 'N/A')}")
+                except Exception as e:
+                    logger.error(f"Error uploading article {article.get('url', 'N/A')}, kept in spool: {str(e)}")
+                    if not retry_store.record_failure(article, UPLOAD_STAGE, e):
+                        # Out of attempts: the article now lives in the dead letters instead of the spool
+                        spool.ack(article_id)
+    except KeyboardInterrupt:
+        logger.info("Upload from the queue stopped")
+    finally:
+        kafka_queue.close()
+        retry_store.close()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload processed articles to the m3 API.")
+    parser.add_argument("--from-queue", action="store_true", help="Consume the processed topic continuously instead of reading queue/processed_content.json")
+    parser.add_argument("-b", "--batch-size", type=int, default=KAFKA_CONSUMER_SETTINGS["max_records"], help=f"Maximum number of messages per batch (default: {KAFKA_CONSUMER_SETTINGS['max_records']})")
+    parser.add_argument("-t", "--max-wait-ms", type=int, default=KAFKA_CONSUMER_SETTINGS["max_wait_ms"], help=f"Maximum time to wait for a batch to fill in milliseconds (default: {KAFKA_CONSUMER_SETTINGS['max_wait_ms']})")
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
-    upload_data()
\ No newline at end of file
+    if args.from_queue:
+        upload_from_queue(args.batch_size, args.max_wait_ms)
+    else:
+        upload_data()
\ No newline at end of file
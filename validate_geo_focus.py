@@ -0,0 +1,88 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import requests
+from text_analysis.GeoFocus import GeoFocusInferrer
+from config import GEO_FOCUS_SETTINGS
+
+R_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'text_analysis', 'infer_geo_focus.R')
+FIXTURE_CORPUS_PATH = os.path.join('text_analysis', 'fixtures', 'geo_focus_corpus.txt')
+# geo_inference_country_names.txt written by infer_geo_focus.R for the fixture corpus
+FIXTURE_EXPECTED_PATH = os.path.join('text_analysis', 'fixtures', 'geo_focus_expected.txt')
+
+def read_corpus(path):
+    """One article per line, as infer_geo_focus.R reads its input."""
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+def run_r_reference(texts):
+    """Run infer_geo_focus.R in a temporary directory and return its country names (None for NA)."""
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'main_texts_for_geo_focus_inference.txt'), 'w', encoding='utf-8') as f:
+            for text in texts:
+                f.write(text + '\n')
+        subprocess.run(['Rscript', R_SCRIPT_PATH], cwd=directory, check=True)
+        with open(os.path.join(directory, 'geo_inference_country_names.txt'), encoding='utf-8') as f:
+            return [None if name == 'NA' else name for name in f.read().strip().split('\n')]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def fetch_dictionary(path=GEO_FOCUS_SETTINGS["dictionary_path"], url=GEO_FOCUS_SETTINGS["dictionary_url"]):
+    """Download the newsmap dictionary once, to be committed; the analysis workers only read the file."""
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(response.text)
+    logging.info(f"Saved the newsmap dictionary from {url} to {path}")
+
+def read_expected(path):
+    with open(path, encoding='utf-8') as f:
+        return [None if name == 'NA' else name for name in f.read().strip().split('\n')]
+
+def compare(texts, expected, predicted):
+    """Log every disagreement and return the share of texts on which both agree."""
+    logger = logging.getLogger(__name__)
+    agreements = 0
+    for i, (text, r_country, python_country) in enumerate(zip(texts, expected, predicted)):
+        if r_country == python_country:
+            agreements += 1
+        else:
+            logger.warning(f"Article {i}: R {r_country or 'NA'}, Python {python_country or 'NA'}: {text[:80]}")
+    return agreements / len(texts)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the in-process geo-focus inference against infer_geo_focus.R.")
+    parser.add_argument("-c", "--corpus", default=FIXTURE_CORPUS_PATH, help=f"Corpus with one article per line (default: {FIXTURE_CORPUS_PATH})")
+    parser.add_argument("-e", "--expected", default=FIXTURE_EXPECTED_PATH, help=f"Saved output of infer_geo_focus.R for the corpus (default: {FIXTURE_EXPECTED_PATH})")
+    parser.add_argument("--rscript", action="store_true", help="Run infer_geo_focus.R instead of reading the saved output")
+    parser.add_argument("--save-expected", help="Write the output of infer_geo_focus.R to this file, to validate without R later")
+    parser.add_argument("--fetch-dictionary", action="store_true", help="Download the newsmap dictionary to its configured path first")
+    parser.add_argument("--min-agreement", type=float, default=0.95, help="Fail below this share of agreeing articles (default: 0.95)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.fetch_dictionary:
+        fetch_dictionary()
+    texts = read_corpus(args.corpus)
+    if args.rscript:
+        expected = run_r_reference(texts)
+    elif os.path.exists(args.expected):
+        expected = read_expected(args.expected)
+    else:
+        parser.error(f"No saved R output at {args.expected}; create it on a machine with R with "
+                     f"--rscript --save-expected {args.expected}")
+    if len(expected) != len(texts):
+        parser.error(f"{args.expected} has {len(expected)} results for {len(texts)} articles")
+    if args.save_expected:
+        with open(args.save_expected, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(name or 'NA' for name in expected) + '\n')
+    predicted = GeoFocusInferrer().infer(texts)
+
+    agreement = compare(texts, expected, predicted)
+    logging.info(f"Python and R agree on {agreement:.1%} of {len(texts)} articles")
+    sys.exit(0 if agreement >= args.min_agreement else 1)